@@ -0,0 +1,60 @@
+"""
+Article summaries for listing pages.
+
+Each article stores a short `excerpt` and a `word_count` alongside its
+body, written when the article is saved, so listings can leave the
+potentially large `article_article` body out of their queries.
+"""
+from pymongo import UpdateOne
+
+# Projection used by every listing query: everything except the body
+SUMMARY_PROJECTION = {"article_article": 0}
+
+# Longest excerpt stored, in characters
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """
+    Returns the start of an article body cut at a word boundary.
+    """
+    text = " ".join((text or "").split())
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(" ", 1)[0] or text[:length]
+    return cut.rstrip(" ,.;:") + "…"
+
+
+def summary_fields(text):
+    """
+    Returns the excerpt and word count fields to store for a body.
+    """
+    return {
+        "excerpt": make_excerpt(text),
+        "word_count": len((text or "").split()),
+    }
+
+
+def backfill_summaries(db, batch_size=500, refresh=False):
+    """
+    Stores excerpts and word counts on articles that do not have them
+    yet, or on every article when refresh is set. Returns the number
+    of articles updated.
+    """
+    query = {} if refresh else {"excerpt": {"$exists": False}}
+    cursor = db.articles.find(query, {"article_article": 1},
+                              batch_size=batch_size)
+    updated = 0
+    requests = []
+    for article in cursor:
+        requests.append(UpdateOne(
+            {"_id": article["_id"]},
+            {"$set": summary_fields(article.get("article_article"))}))
+        if len(requests) >= batch_size:
+            updated += db.articles.bulk_write(
+                requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += db.articles.bulk_write(
+            requests, ordered=False).modified_count
+    return updated
@@ -0,0 +1,138 @@
+"""
+Static asset fingerprinting and precompression.
+
+build_assets() copies every file in the static folder to a name that
+includes a hash of its content, writes gzip and brotli versions of the
+compressible ones next to it and records the mapping in a manifest.
+StaticAssets makes url_for('static', ...) produce the fingerprinted
+names and serves them with an immutable Cache-Control, picking the
+precompressed variant the browser accepts.
+
+Brotli output needs the optional `brotli` package; without it only
+gzip files are written.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+
+MANIFEST = "manifest.json"
+
+# Content types worth precompressing
+COMPRESSIBLE = ("text/", "application/javascript", "application/json",
+                "image/svg+xml", "application/xml")
+
+# Extensions of files the build itself writes
+OUTPUT_RE = re.compile(r"\.[0-9a-f]{12}\.[^.]+(\.gz|\.br)?$")
+
+# Cache-Control for fingerprinted asset URLs
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Encodings in order of preference: Accept-Encoding token -> suffix
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def compressible(path):
+    mimetype = mimetypes.guess_type(path)[0] or ""
+    return mimetype.startswith(COMPRESSIBLE)
+
+
+def fingerprinted_name(path, digest):
+    root, extension = os.path.splitext(path)
+    return "{}.{}{}".format(root, digest[:12], extension)
+
+
+def build_assets(static_dir):
+    """
+    Fingerprints and precompresses every asset under static_dir and
+    returns the manifest mapping logical to fingerprinted names.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    manifest = {}
+    for folder, _, files in os.walk(static_dir):
+        for name in files:
+            path = os.path.join(folder, name)
+            logical = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            if logical == MANIFEST or OUTPUT_RE.search(name):
+                continue
+
+            with open(path, "rb") as f:
+                data = f.read()
+            hashed = fingerprinted_name(
+                logical, hashlib.sha256(data).hexdigest())
+            target = os.path.join(static_dir, hashed)
+            shutil.copyfile(path, target)
+
+            if compressible(name):
+                with open(target + ".gz", "wb") as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + ".br", "wb") as f:
+                        f.write(brotli.compress(data))
+            manifest[logical] = hashed
+
+    with open(os.path.join(static_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """
+    Flask extension serving the fingerprinted, precompressed assets
+    listed in the static folder's manifest.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.fingerprinted = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_dir = app.static_folder
+        self.load()
+        app.url_defaults(self._fingerprint)
+        app.view_functions["static"] = self.send
+
+    def load(self):
+        """
+        Reads the manifest written by build_assets(), if there is one.
+        """
+        path = os.path.join(self.static_dir or "", MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+        self.fingerprinted = set(self.manifest.values())
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]
+
+    def send(self, filename):
+        if filename not in self.fingerprinted:
+            return send_from_directory(self.static_dir, filename)
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        for token, suffix in ENCODINGS:
+            candidate = os.path.join(self.static_dir, filename + suffix)
+            if (token in request.accept_encodings
+                    and os.path.exists(candidate)):
+                response = send_from_directory(
+                    self.static_dir, filename + suffix, mimetype=mimetype)
+                response.headers["Content-Encoding"] = token
+                break
+        else:
+            response = send_from_directory(self.static_dir, filename)
+
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        return response
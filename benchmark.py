@@ -0,0 +1,406 @@
+"""
+Reproducible load and benchmark suite for run.py.
+
+Seeds a database with synthetic users, topics, locations, articles and
+further_reading at a chosen scale, drives the real Flask app through its
+test client (or a running server over HTTP with concurrent workers) and
+reports p50/p95/p99 latency and throughput per route, with how much the
+process's peak RSS grew during the route and the peak so far. Results
+are saved as JSON so that two runs can be compared.
+
+    python benchmark.py seed --scale 10k
+    python benchmark.py run --requests 200 --out before.json
+    python benchmark.py run --url http://localhost:5000 --concurrency 16
+    python benchmark.py compare before.json after.json
+
+Set MONGO_URI / MONGO_DBNAME to a local database, or pass --in-process
+to use mongomock (installed separately) instead of a real server.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from article_summary import summary_fields
+from facets import date_fields
+from indexes import ensure_indexes
+from topic_refs import migrate_topic_ids
+from topic_stats import rebuild_topic_stats
+from user_stats import rebuild_user_stats
+
+SCALES = {"10k": 10000, "100k": 100000, "1m": 1000000}
+
+# Password given to every seeded user
+PASSWORD = "benchmark_password"
+
+WORDS = ("climate ocean forest river carbon energy solar wind species "
+         "habitat plastic recycling water soil farming city transport "
+         "policy emissions wildlife coral glacier drought flood storm "
+         "biodiversity pollution community garden bee insect bird").split()
+
+SEED_BATCH = 5000
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(db, articles, seed_value=1):
+    """
+    Replaces the benchmark collections with a deterministic dataset
+    holding the given number of articles.
+    """
+    rng = random.Random(seed_value)
+    for name in ("users", "topics", "locations", "articles",
+                 "further_reading"):
+        db[name].drop()
+
+    password = generate_password_hash(PASSWORD)
+    # The scenarios log in as admin, who may edit any article
+    users = ["admin"] + ["user{}".format(i)
+                         for i in range(max(articles // 100, 10))]
+    db.users.insert_many([{"username": name,
+                           "email": "{}@example.com".format(name),
+                           "password": password} for name in users])
+
+    topics = ["{} {}".format(word.title(), i)
+              for i, word in enumerate(WORDS)]
+    db.topics.insert_many([{"topic_name": name, "article_count": 0,
+                            "article_list": []} for name in topics])
+    locations = ["Location {}".format(i) for i in range(50)]
+    db.locations.insert_many([{"location_name": name}
+                              for name in locations])
+
+    batch = []
+    for i in range(articles):
+        body = " ".join(sentence(rng, 12) + "." for _ in range(
+            rng.randint(5, 40)))
+        article = {
+            "topic_name": rng.choice(topics),
+            "article_name": sentence(rng, rng.randint(2, 6)).title(),
+            "image_url": "https://example.com/{}.jpg".format(i),
+            "article_article": body,
+            "location_name": rng.choice(locations),
+            "created_by": rng.choice(users),
+            "date_added": "2020-{:02d}-{:02d}".format(
+                rng.randint(1, 12), rng.randint(1, 28)),
+        }
+        article.update(summary_fields(body))
+        article.update(date_fields(article["date_added"]))
+        batch.append(article)
+        if len(batch) >= SEED_BATCH:
+            db.articles.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.articles.insert_many(batch, ordered=False)
+
+    db.further_reading.insert_many([{
+        "topic_name": rng.choice(topics),
+        "book_title": sentence(rng, 3).title(),
+        "website": "https://example.com/reading/{}".format(i),
+        "article_title": sentence(rng, 5).title(),
+        "author": "Author {}".format(i),
+        "date_published": "2019",
+        "publisher": "Publisher {}".format(i % 20),
+    } for i in range(max(articles // 50, 20))])
+
+    ensure_indexes(db)
+    migrate_topic_ids(db, report=lambda message: None)
+    rebuild_topic_stats(db)
+    rebuild_user_stats(db)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1)
+    return ordered[max(index, 0)]
+
+
+# Hidden CSRF token field rendered into the site's forms
+CSRF_INPUT_RE = re.compile(r'<input[^>]*name="csrf_token"[^>]*>')
+VALUE_RE = re.compile(r'value="([^"]*)"')
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def summarize(route, latencies, errors, elapsed, rss_before):
+    peak = peak_rss_kb()
+    return {
+        "route": route,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        # ru_maxrss only ever rises, so a route shows the growth of the
+        # process peak while it ran; peak_rss_kb is the process peak
+        "rss_growth_kb": peak - rss_before,
+        "peak_rss_kb": peak,
+    }
+
+
+def scenarios(db, rng):
+    """
+    Returns (name, method, path factory, form factory, logged in)
+    tuples covering the read routes and the add/edit flows.
+    """
+    topic_ids = [str(topic["_id"])
+                 for topic in db.topics.find({}, {"_id": 1})]
+    users = [user["username"] for user in
+             db.users.find({}, {"username": 1}).limit(100)]
+    article_count = db.articles.estimated_document_count()
+    pages = max(article_count // 6, 1)
+    sample = list(db.articles.find({}, {"_id": 1, "created_by": 1,
+                                        "topic_name": 1}).limit(100))
+
+    def article_form():
+        return {"topic_name": "Climate 0",
+                "article_name": sentence(rng, 4).title(),
+                "image_url": "https://example.com/new.jpg",
+                "article_article": sentence(rng, 200),
+                "location_name": "Location 1",
+                "date_added": "2021-01-01"}
+
+    return [
+        ("index", "GET", lambda: "/", None, False),
+        ("articles", "GET",
+         lambda: "/articles?page={}".format(rng.randint(1, pages)),
+         None, False),
+        ("search", "GET",
+         lambda: "/search?" + urllib.parse.urlencode(
+             {"query": rng.choice(WORDS)}),
+         None, False),
+        ("filter_topics", "GET",
+         lambda: "/filter/topic/{}".format(rng.choice(topic_ids)),
+         None, False),
+        ("profile", "GET",
+         lambda: "/profile/admin", None, True),
+        ("login", "POST", lambda: "/login",
+         lambda: {"username": rng.choice(users), "password": PASSWORD},
+         False),
+        ("add_article", "POST", lambda: "/add_article", article_form, True),
+        ("edit_article", "POST",
+         lambda: "/edit_article/{}".format(rng.choice(sample)["_id"]),
+         article_form, True),
+    ]
+
+
+def run_test_client(app, db, requests_per_route, rng):
+    """
+    Drives every scenario sequentially through the Flask test client.
+    """
+    app.config["WTF_CSRF_ENABLED"] = False
+    results = []
+    for name, method, path, form, logged_in in scenarios(db, rng):
+        client = app.test_client()
+        if logged_in:
+            with client.session_transaction() as session:
+                session["user"] = "admin"
+        latencies, errors = [], 0
+        rss_before = peak_rss_kb()
+        started = time.perf_counter()
+        for _ in range(requests_per_route):
+            began = time.perf_counter()
+            response = client.open(path(), method=method,
+                                   data=form() if form else None)
+            latencies.append((time.perf_counter() - began) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+        results.append(summarize(name, latencies, errors,
+                                 time.perf_counter() - started, rss_before))
+    return results
+
+
+def run_http(base_url, db, requests_per_route, concurrency, rng):
+    """
+    Drives the anonymous scenarios against a running server with a
+    pool of concurrent workers. Peak RSS is the load generator's own.
+    Each worker keeps its own session cookie and CSRF token, fetched
+    from the form page before its first POST.
+    """
+    results = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def session_for(url):
+        if getattr(local, "opener", None) is None:
+            local.opener = urllib.request.build_opener(
+                urllib.request.HTTPCookieProcessor(
+                    http.cookiejar.CookieJar()))
+            local.tokens = {}
+        if url not in local.tokens:
+            with local.opener.open(base_url + url) as reply:
+                page = reply.read().decode("utf-8", "replace")
+            field = CSRF_INPUT_RE.search(page)
+            value = VALUE_RE.search(field.group(0)) if field else None
+            local.tokens[url] = value.group(1) if value else ""
+        return local.opener, local.tokens[url]
+    for name, method, path, form, logged_in in scenarios(db, rng):
+        if logged_in:
+            continue
+        jobs = [(path(), form() if form else None)
+                for _ in range(requests_per_route)]
+        latencies, errors = [], []
+
+        def fetch(job):
+            url, data = job
+            body = None
+            opener = urllib.request.build_opener()
+            try:
+                if data is not None:
+                    opener, token = session_for(url)
+                    body = urllib.parse.urlencode(
+                        dict(data, csrf_token=token)).encode()
+            except OSError:
+                opener = None
+            began = time.perf_counter()
+            try:
+                if opener is None:
+                    raise OSError("could not fetch a CSRF token")
+                with opener.open(base_url + url, body) as reply:
+                    reply.read()
+                failed = False
+            except OSError:
+                # HTTPError included: a 4xx such as a CSRF rejection
+                # is not a timing of the route
+                failed = True
+            with lock:
+                latencies.append((time.perf_counter() - began) * 1000)
+                errors.append(failed)
+
+        rss_before = peak_rss_kb()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(fetch, jobs))
+        results.append(summarize(name, latencies, sum(errors),
+                                 time.perf_counter() - started, rss_before))
+    return results
+
+
+def print_results(results):
+    print("{:<14} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}".format(
+        "route", "reqs", "errs", "p50 ms", "p95 ms", "p99 ms", "req/s",
+        "rss +kb", "peak kb"))
+    for row in results:
+        print("{route:<14} {requests:>6} {errors:>6} {p50_ms:>9.2f} "
+              "{p95_ms:>9.2f} {p99_ms:>9.2f} {throughput_rps:>9.1f} "
+              "{rss_growth_kb:>10} {peak_rss_kb:>10}".format(**row))
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = {row["route"]: row for row in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = {row["route"]: row for row in json.load(f)["results"]}
+    print("{:<14} {:>12} {:>12} {:>12}".format(
+        "route", "p50 change", "p95 change", "req/s change"))
+    for route in sorted(set(before) & set(after)):
+        changes = []
+        for key in ("p50_ms", "p95_ms", "throughput_rps"):
+            old, new = before[route][key], after[route][key]
+            changes.append("{:+.1f}%".format((new - old) / old * 100)
+                           if old else "n/a")
+        print("{:<14} {:>12} {:>12} {:>12}".format(route, *changes))
+
+
+def load_app(in_process):
+    """
+    Imports run.py, pointing it at mongomock and the in-memory search
+    backend when in_process is set.
+    """
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/spare_bench")
+    # Every benchmark request comes from one client
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    if in_process:
+        # mongomock cannot run $text queries
+        os.environ.setdefault("SEARCH_BACKEND", "memory")
+    import run
+    if in_process:
+        import mongomock
+        run.mongo.cx = mongomock.MongoClient()
+        run.mongo.db = run.mongo.cx[os.environ.get("MONGO_DBNAME",
+                                                   "spare_bench")]
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--in-process", action="store_true",
+                        help="use mongomock instead of MONGO_URI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed")
+    seed_parser.add_argument("--scale", default="10k",
+                             help="10k, 100k, 1m or an article count")
+    seed_parser.add_argument("--seed", type=int, default=1)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--requests", type=int, default=100,
+                            help="requests per route")
+    run_parser.add_argument("--url", help="benchmark a running server")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--scale", help="seed this scale first")
+    run_parser.add_argument("--out", help="save results as JSON")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        compare(args.before, args.after)
+        return
+
+    run = load_app(args.in_process)
+    db = run.mongo.db
+    scale = getattr(args, "scale", None)
+    if scale:
+        articles = SCALES.get(scale.lower()) or int(scale)
+        started = time.perf_counter()
+        seed(db, articles, args.seed)
+        print("Seeded {} articles in {:.1f}s".format(
+            articles, time.perf_counter() - started))
+    if args.command == "seed":
+        return
+
+    rng = random.Random(args.seed)
+    if args.url:
+        results = run_http(args.url.rstrip("/"), db, args.requests,
+                           args.concurrency, rng)
+    else:
+        results = run_test_client(run.app, db, args.requests, rng)
+    print_results(results)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"created": time.time(),
+                       "python": platform.python_version(),
+                       "articles": db.articles.estimated_document_count(),
+                       "mode": "http" if args.url else "test_client",
+                       "requests_per_route": args.requests,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Streaming NDJSON import and export for articles, topics and
+further_reading.
+
+Documents are read and written one line at a time and sent to MongoDB
+in batches, so memory use does not grow with the size of the file.
+Imports validate each document against the fields the form routes
+write, can upsert on a natural key, and record a checkpoint after every
+batch so an interrupted run can resume where it stopped.
+"""
+import json
+import os
+import sys
+import time
+
+from bson import json_util
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from article_summary import summary_fields
+from facets import date_fields
+
+# Fields each collection accepts, which of them must be filled in, the
+# fields that identify a document for upserts, the derived fields that
+# are dropped on import and recomputed, and the counters, which are
+# whole numbers kept as they are
+SCHEMAS = {
+    "articles": {
+        "fields": ("topic_name", "article_name", "image_url",
+                   "article_article", "location_name", "created_by",
+                   "date_added", "image_id"),
+        "required": ("topic_name", "article_name", "article_article",
+                     "created_by"),
+        "key": ("created_by", "article_name"),
+        "derived": ("excerpt", "word_count", "topic_id", "date_key"),
+        "counters": ("views",),
+    },
+    "topics": {
+        "fields": ("topic_name",),
+        "required": ("topic_name",),
+        "key": ("topic_name",),
+        "derived": ("article_count", "article_list"),
+        "counters": (),
+    },
+    "further_reading": {
+        "fields": ("topic_name", "book_title", "website", "article_title",
+                   "author", "date_published", "publisher"),
+        "required": ("topic_name",),
+        "key": ("topic_name", "book_title", "article_title", "website"),
+        "derived": ("topic_id",),
+        "counters": (),
+    },
+}
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class InvalidDocument(ValueError):
+    """
+    Raised when an imported line does not match the collection schema.
+    """
+
+
+def validate(collection, document):
+    """
+    Returns the document reduced to the schema's fields, raising
+    InvalidDocument when it is malformed or a required field is empty.
+    """
+    schema = SCHEMAS[collection]
+    if not isinstance(document, dict):
+        raise InvalidDocument("expected a JSON object")
+
+    unknown = (set(document) - set(schema["fields"])
+               - set(schema["derived"]) - set(schema["counters"]) - {"_id"})
+    if unknown:
+        raise InvalidDocument("unknown fields: {}".format(
+            ", ".join(sorted(unknown))))
+
+    cleaned = {}
+    for field in schema["fields"]:
+        if field not in document and field not in schema["required"]:
+            continue
+        value = document.get(field)
+        if value is not None and not isinstance(value, str):
+            raise InvalidDocument("{} must be a string".format(field))
+        if field in schema["required"] and not value:
+            raise InvalidDocument("{} is required".format(field))
+        cleaned[field] = value
+    for field in schema["counters"]:
+        if field not in document:
+            continue
+        value = document[field]
+        if (isinstance(value, bool) or not isinstance(value, int)
+                or value < 0):
+            raise InvalidDocument("{} must be a whole number".format(field))
+        cleaned[field] = value
+    if "_id" in document:
+        cleaned["_id"] = document["_id"]
+
+    if collection == "articles":
+        cleaned.update(summary_fields(cleaned["article_article"]))
+        cleaned.update(date_fields(cleaned.get("date_added")))
+    elif collection == "topics":
+        cleaned.update({"article_count": 0, "article_list": []})
+    return cleaned
+
+
+def export_collection(db, collection, out, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Writes every document of a collection to out as one JSON line each
+    and returns the number written.
+    """
+    count = 0
+    for document in db[collection].find({}, batch_size=batch_size):
+        out.write(json_util.dumps(document))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get("line", 0)
+
+
+def write_checkpoint(path, line):
+    if not path:
+        return
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump({"line": line}, f)
+    os.replace(temp, path)
+
+
+def _write_batch(db, collection, batch, upsert):
+    key = SCHEMAS[collection]["key"]
+    if upsert:
+        requests = []
+        for document in batch:
+            document.pop("_id", None)
+            requests.append(ReplaceOne(
+                {field: document.get(field) for field in key},
+                document, upsert=True))
+    else:
+        requests = [InsertOne(document) for document in batch]
+
+    try:
+        result = db[collection].bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        details = e.details
+        written = (details.get("nInserted", 0) + details.get("nUpserted", 0)
+                   + details.get("nModified", 0))
+        return written, len(details.get("writeErrors", []))
+
+    return (result.inserted_count + result.upserted_count
+            + result.modified_count), 0
+
+
+def import_collection(db, collection, lines, batch_size=DEFAULT_BATCH_SIZE,
+                      upsert=False, checkpoint=None, report=None):
+    """
+    Imports NDJSON lines into a collection and returns a dict of
+    written, invalid and failed counts. Lines already covered by the
+    checkpoint file are skipped.
+    """
+    report = report or (lambda message: print(message, file=sys.stderr))
+    skip = read_checkpoint(checkpoint)
+    totals = {"written": 0, "invalid": 0, "failed": 0}
+    started = time.monotonic()
+    batch = []
+    line_number = 0
+
+    def flush():
+        written, failed = _write_batch(db, collection, batch, upsert)
+        totals["written"] += written
+        totals["failed"] += failed
+        batch.clear()
+        write_checkpoint(checkpoint, line_number)
+        elapsed = time.monotonic() - started
+        report("{}: line {} written {} ({:.0f} docs/s)".format(
+            collection, line_number, totals["written"],
+            totals["written"] / elapsed if elapsed else 0))
+
+    for line_number, line in enumerate(lines, 1):
+        if line_number <= skip or not line.strip():
+            continue
+        try:
+            batch.append(validate(collection, json_util.loads(line)))
+        except (InvalidDocument, ValueError) as e:
+            totals["invalid"] += 1
+            report("{}: line {} skipped: {}".format(
+                collection, line_number, e))
+            continue
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    else:
+        write_checkpoint(checkpoint, line_number)
+    return totals
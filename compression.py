@@ -0,0 +1,236 @@
+"""
+WSGI response compression.
+
+Negotiates brotli or gzip from Accept-Encoding, leaves alone small
+bodies, already encoded responses and content types that do not
+compress, and compresses streamed bodies incrementally. Template
+streams arrive in many tiny chunks, so the compressor is only flushed
+once FLUSH_SIZE bytes have gone in since the last flush: streaming
+still reaches the browser progressively without giving up the ratio.
+
+Compressed responses get an encoding-specific ETag so that conditional
+GET keeps working: the suffix is stripped from If-None-Match before the
+app sees it and added back to the app's ETag on the way out.
+
+Brotli needs the optional `brotli` package; without it only gzip is
+offered.
+"""
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json",
+                "application/xml", "image/svg+xml")
+
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 1024
+# Uncompressed bytes between flushes of a streamed body
+FLUSH_SIZE = 16 * 1024
+
+
+def accepted_encodings(header):
+    """
+    Returns the encodings an Accept-Encoding header allows, with their
+    q-values.
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+    return accepted
+
+
+class Compressor:
+    """
+    Incremental gzip or brotli compressor with optional flushing.
+    """
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=min(level, 11))
+        else:
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + self._brotli.flush() if flush else out
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    Wraps a WSGI app and compresses its responses.
+    """
+
+    def __init__(self, app, level=DEFAULT_LEVEL, min_size=DEFAULT_MIN_SIZE):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+        self.stats = {"responses": 0, "bytes_in": 0, "bytes_out": 0,
+                      "cpu_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def choose_encoding(self, environ):
+        accepted = accepted_encodings(environ.get("HTTP_ACCEPT_ENCODING"))
+        for encoding in ("br", "gzip"):
+            if encoding == "br" and brotli is None:
+                continue
+            if accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return None
+
+    def record(self, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += bytes_out
+            self.stats["cpu_seconds"] += cpu_seconds
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose_encoding(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        suffix = '-{}"'.format(encoding)
+        if environ.get("HTTP_IF_NONE_MATCH"):
+            environ["HTTP_IF_NONE_MATCH"] = environ[
+                "HTTP_IF_NONE_MATCH"].replace(suffix, '"')
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured["status"] = status
+            captured["headers"] = headers
+            captured["exc_info"] = exc_info
+            return lambda data: None
+
+        body = self.app(environ, capture)
+        try:
+            chunks = iter(body)
+            first = next(chunks, b"")
+        except BaseException:
+            if hasattr(body, "close"):
+                body.close()
+            raise
+        return self._respond(environ, start_response, captured, body,
+                             first, chunks, encoding, suffix)
+
+    def _wanted(self, environ, status, headers):
+        names = {name.lower(): value for name, value in headers}
+        mimetype = names.get("content-type", "").split(";")[0].strip()
+        length = names.get("content-length")
+        return (environ.get("REQUEST_METHOD") != "HEAD"
+                and status[:3] not in ("204", "206", "304")
+                and "content-encoding" not in names
+                and mimetype.startswith(COMPRESSIBLE)
+                and (length is None or int(length) >= self.min_size))
+
+    def _respond(self, environ, start_response, captured, body, first,
+                 chunks, encoding, suffix):
+        status, headers = captured["status"], captured["headers"]
+        names = {name.lower(): value for name, value in headers}
+        mimetype = names.get("content-type", "").split(";")[0].strip()
+
+        if mimetype.startswith(COMPRESSIBLE):
+            headers = self._add_vary(headers)
+        if status[:3] == "304" and "etag" in names:
+            headers = self._tag(headers, suffix)
+
+        buffered = [first] if first else []
+        wanted = self._wanted(environ, status, headers)
+        if wanted and "content-length" not in names:
+            # Buffer a streamed body until it is big enough to bother
+            size = len(first)
+            while size < self.min_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    wanted = False
+                    break
+                buffered.append(chunk)
+                size += len(chunk)
+
+        if not wanted:
+            start_response(status, headers, captured["exc_info"])
+            return self._passthrough(body, buffered, chunks)
+
+        headers = [(name, value) for name, value in headers
+                   if name.lower() != "content-length"]
+        headers.append(("Content-Encoding", encoding))
+        headers = self._tag(headers, suffix)
+        start_response(status, headers, captured["exc_info"])
+        with self._lock:
+            self.stats["responses"] += 1
+        return self._compress(body, buffered, chunks,
+                              Compressor(encoding, self.level))
+
+    def _add_vary(self, headers):
+        for index, (name, value) in enumerate(headers):
+            if name.lower() == "vary":
+                if "accept-encoding" not in value.lower():
+                    headers[index] = (name, value + ", Accept-Encoding")
+                return headers
+        return headers + [("Vary", "Accept-Encoding")]
+
+    def _tag(self, headers, suffix):
+        return [(name, value[:-1] + suffix
+                 if name.lower() == "etag" and value.endswith('"')
+                 else value) for name, value in headers]
+
+    def _passthrough(self, body, buffered, chunks):
+        try:
+            yield from buffered
+            yield from chunks
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    def _compress(self, body, buffered, chunks, compressor):
+        bytes_in = bytes_out = 0
+        unflushed = 0
+        cpu = 0.0
+        try:
+            for source in (buffered, chunks):
+                for chunk in source:
+                    if not chunk:
+                        continue
+                    unflushed += len(chunk)
+                    flush = unflushed >= FLUSH_SIZE
+                    if flush:
+                        unflushed = 0
+                    started = time.thread_time()
+                    out = compressor.compress(chunk, flush)
+                    cpu += time.thread_time() - started
+                    bytes_in += len(chunk)
+                    bytes_out += len(out)
+                    if out:
+                        yield out
+            started = time.thread_time()
+            out = compressor.finish()
+            cpu += time.thread_time() - started
+            bytes_out += len(out)
+            yield out
+        finally:
+            self.record(bytes_in, bytes_out, cpu)
+            if hasattr(body, "close"):
+                body.close()
@@ -0,0 +1,155 @@
+"""
+Faceted article browsing by topic, location and date.
+
+browse() answers a filtered page together with the number of matching
+articles per topic and per location in a single $facet aggregation.
+The counts depend only on the filter, so they are cached per filter
+combination and later pages of the same filter need just one find().
+
+Dates are compared on `date_key`, the ISO form of the free-text
+`date_added`, which is stored when an article is saved.
+"""
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from article_summary import SUMMARY_PROJECTION
+from pagination import PER_PAGE
+from topic_refs import topic_match
+
+# Formats accepted for date_added and for the from/to filter arguments
+DATE_FORMATS = ("%Y-%m-%d", "%b %d, %Y", "%B %d, %Y", "%d %B %Y",
+                "%d/%m/%Y")
+
+
+def date_key(value):
+    """
+    Returns a date string as YYYY-MM-DD, or None when it is empty or
+    not in a known format.
+    """
+    value = " ".join((value or "").split())
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def date_fields(date_added):
+    """
+    Returns the date_key field to store for an article's date_added.
+    """
+    return {"date_key": date_key(date_added)}
+
+
+def facet_match(topic=None, location=None, date_from=None, date_to=None):
+    """
+    Returns the articles filter for any mix of topic document, location
+    and inclusive date range. Unmigrated articles naming the topic
+    match too, as they are counted in its facet.
+    """
+    match = {}
+    if topic is not None:
+        match.update(topic_match(topic))
+    if location:
+        match["location_name"] = location
+    if date_from or date_to:
+        match["date_key"] = {}
+        if date_from:
+            match["date_key"]["$gte"] = date_from
+        if date_to:
+            match["date_key"]["$lte"] = date_to
+    return match
+
+
+def browse(collection, topic=None, location=None, date_from=None,
+           date_to=None, page=1, per_page=PER_PAGE, cache=None):
+    """
+    Returns one newest-first page of matching articles and the facet
+    counts {"total", "topics", "locations"} for the filter. Topic
+    counts are keyed by topic_id, or by topic_name for articles not
+    yet migrated.
+    """
+    key = (topic and (topic["_id"], topic["topic_name"]), location,
+           date_from, date_to)
+    match = facet_match(topic, location, date_from, date_to)
+    page_stages = [{"$skip": (page - 1) * per_page},
+                   {"$limit": per_page},
+                   {"$project": SUMMARY_PROJECTION}]
+    loaded = {}
+
+    def load():
+        pipeline = [
+            {"$match": match},
+            # Sorting before $facet lets the index supply the order;
+            # stages inside $facet cannot use indexes
+            {"$sort": {"_id": -1}},
+            {"$facet": {
+                "page": page_stages,
+                "total": [{"$count": "count"}],
+                "topics": [{"$group": {
+                    "_id": {"$ifNull": ["$topic_id", "$topic_name"]},
+                    "count": {"$sum": 1}}}],
+                "locations": [{"$group": {"_id": "$location_name",
+                                          "count": {"$sum": 1}}}],
+            }},
+        ]
+        facets = next(collection.aggregate(pipeline, allowDiskUse=True))
+        loaded["page"] = facets["page"]
+        return {
+            "total": facets["total"][0]["count"] if facets["total"] else 0,
+            "topics": {group["_id"]: group["count"]
+                       for group in facets["topics"]},
+            "locations": {group["_id"]: group["count"]
+                          for group in facets["locations"]},
+        }
+
+    counts = load() if cache is None else cache.get(key, load)
+    if "page" in loaded:
+        return loaded["page"], counts
+
+    items = list(collection.find(match, SUMMARY_PROJECTION)
+                 .sort("_id", -1).skip((page - 1) * per_page)
+                 .limit(per_page))
+    return items, counts
+
+
+def topic_facets(counts, topics):
+    """
+    Returns (topic, count) pairs for every topic.
+    """
+    return [(topic, counts["topics"].get(topic["_id"], 0)
+             + counts["topics"].get(topic["topic_name"], 0))
+            for topic in topics]
+
+
+def location_facets(counts, locations):
+    """
+    Returns (location, count) pairs for every location.
+    """
+    return [(location, counts["locations"].get(location["location_name"], 0))
+            for location in locations]
+
+
+def backfill_date_keys(db, batch_size=500):
+    """
+    Stores date_key on articles saved before it existed and returns
+    the number of articles updated.
+    """
+    cursor = db.articles.find({"date_key": {"$exists": False}},
+                              {"date_added": 1}, batch_size=batch_size)
+    updated = 0
+    requests = []
+    for article in cursor:
+        requests.append(UpdateOne(
+            {"_id": article["_id"]},
+            {"$set": date_fields(article.get("date_added"))}))
+        if len(requests) >= batch_size:
+            updated += db.articles.bulk_write(
+                requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += db.articles.bulk_write(
+            requests, ordered=False).modified_count
+    return updated
@@ -0,0 +1,103 @@
+"""
+Concurrent fan-out of independent reads within one request.
+
+A single bounded thread pool is shared by every request, and its size
+is capped by the MongoDB connection pool so that fanned-out reads can
+never queue behind each other for a connection. The first call of a
+gather runs on the calling thread while the rest go to the pool, and
+gathers made from inside the pool run inline, so nesting cannot
+deadlock.
+
+Pool threads get no request context: popping a copied one would run
+the teardown hooks and close the request's uploaded files once per
+call. Only the first call may read the request; the others must be
+given what they need as arguments.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FanoutTimeout
+
+from metrics import activate, current_stats
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 10
+
+
+class Fanout:
+    """
+    Runs independent callables in parallel and gathers their results.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, pool_size=None,
+                 timeout=DEFAULT_TIMEOUT):
+        if pool_size:
+            max_workers = min(max_workers, pool_size)
+        self.max_workers = max(max_workers, 1)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="fanout",
+                    initializer=self._mark_worker)
+            return self._executor
+
+    def _mark_worker(self):
+        self._local.worker = True
+
+    def _wrap(self, call):
+        stats = current_stats()
+
+        def run():
+            # Attribute the worker's MongoDB commands to the request
+            activate(stats)
+            try:
+                return call()
+            finally:
+                activate(None)
+        return run
+
+    def gather(self, *calls, timeout=None):
+        """
+        Runs every call concurrently and returns their results in the
+        same order. The first exception raised by a call is re-raised
+        here. FanoutTimeout is raised when a pooled call has not
+        finished timeout seconds after it was submitted, however long
+        the first call, which runs inline and cannot be interrupted,
+        took.
+        """
+        if len(calls) < 2 or getattr(self._local, "worker", False):
+            return [call() for call in calls]
+
+        timeout = self.timeout if timeout is None else timeout
+        pool = self._pool()
+        deadline = time.monotonic() + timeout
+        futures = [pool.submit(self._wrap(call)) for call in calls[1:]]
+        try:
+            first = calls[0]()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        done, pending = wait(
+            futures, timeout=max(deadline - time.monotonic(), 0))
+        if pending:
+            for future in pending:
+                future.cancel()
+            raise FanoutTimeout(
+                "{} of {} reads did not finish within {}s".format(
+                    len(pending), len(calls), timeout))
+        return [first] + [future.result() for future in futures]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
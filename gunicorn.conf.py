@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for production: gunicorn -c gunicorn.conf.py
+
+WEB_CONCURRENCY and GUNICORN_THREADS set the worker and thread counts
+that run.py also sizes its MongoDB pools from. With PRELOAD_APP the app
+is imported once in the master and shared copy-on-write; either way each
+worker creates its own MongoClient and warms up after the fork, before
+it accepts requests.
+"""
+import os
+
+from serving import thread_count, worker_count
+
+bind = "{}:{}".format(os.environ.get("IP", "0.0.0.0"),
+                      os.environ.get("PORT", "8000"))
+wsgi_app = "run:app"
+workers = worker_count()
+threads = thread_count()
+worker_class = "gthread"
+preload_app = os.environ.get("PRELOAD_APP", "1") == "1"
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+# Recycle workers now and then, staggered so they do not all restart
+# and reconnect together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    from run import create_app
+    create_app()
@@ -0,0 +1,148 @@
+"""
+Article image ingestion with pre-generated variants.
+
+Uploaded images are stored in GridFS under the SHA-256 of the original
+file, along with card and thumbnail sized WebP and JPEG variants made
+at upload time. Because the names are content addressed, every URL can
+be served with an immutable, far-future cache lifetime.
+
+Resizing needs Pillow, which is only imported when an image is
+ingested.
+"""
+import hashlib
+import io
+import os
+from urllib.parse import urlparse
+
+import gridfs
+
+# Longest side limits of the generated variants
+VARIANTS = {
+    "card": (800, 600),
+    "thumb": (240, 240),
+}
+
+# Output formats: file extension -> (Pillow format, mimetype, options)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True,
+                                   "progressive": True}),
+}
+
+# Cache-Control for content addressed image URLs
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+IMAGE_COLLECTION = "images"
+
+
+class InvalidImage(ValueError):
+    """
+    Raised when uploaded data cannot be read as an image.
+    """
+
+
+def variant_name(digest, variant, extension):
+    return "{}-{}.{}".format(digest, variant, extension)
+
+
+def image_store(db):
+    return gridfs.GridFS(db, collection=IMAGE_COLLECTION)
+
+
+def _render(image, size, extension):
+    from PIL import Image
+
+    pillow_format, mimetype, options = FORMATS[extension]
+    resized = image.copy()
+    resized.thumbnail(size, Image.LANCZOS)
+    if pillow_format == "JPEG" and resized.mode not in ("RGB", "L"):
+        resized = resized.convert("RGB")
+    out = io.BytesIO()
+    resized.save(out, pillow_format, **options)
+    return out.getvalue(), mimetype
+
+
+def ingest_image(db, data):
+    """
+    Stores an image and its variants, returning the SHA-256 digest
+    that identifies them. Images already stored are not processed
+    again.
+    """
+    try:
+        from PIL import Image, UnidentifiedImageError
+    except ImportError:
+        raise RuntimeError("Pillow is required to ingest images")
+
+    digest = hashlib.sha256(data).hexdigest()
+    store = image_store(db)
+    if store.exists(filename=variant_name(digest, "thumb", "jpg")):
+        return digest
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError,
+            OSError) as e:
+        raise InvalidImage(str(e))
+
+    store.put(data, filename="{}-original".format(digest),
+              contentType=Image.MIME.get(image.format,
+                                         "application/octet-stream"))
+    for variant, size in VARIANTS.items():
+        for extension in FORMATS:
+            body, mimetype = _render(image, size, extension)
+            store.put(body, filename=variant_name(digest, variant, extension),
+                      contentType=mimetype)
+    return digest
+
+
+def open_variant(db, digest, variant, extension):
+    """
+    Returns the stored GridFS file for a variant, or None.
+    """
+    if variant not in VARIANTS or extension not in FORMATS:
+        return None
+    try:
+        return image_store(db).get_last_version(
+            variant_name(digest, variant, extension))
+    except gridfs.NoFile:
+        return None
+
+
+def mirror_path(mirror_dir, image_url):
+    """
+    Returns the file in the local mirror directory holding a copy of
+    image_url, matched on the URL's file name, or None.
+    """
+    name = os.path.basename(urlparse(image_url or "").path)
+    if not name:
+        return None
+    path = os.path.join(mirror_dir, name)
+    return path if os.path.isfile(path) else None
+
+
+def backfill_images(db, mirror_dir, report=print):
+    """
+    Ingests the mirrored copy of every article image_url that has no
+    stored image yet. Returns (converted, missing) counts.
+    """
+    converted = missing = 0
+    query = {"image_url": {"$nin": [None, ""]},
+             "image_id": {"$exists": False}}
+    for article in db.articles.find(query, {"image_url": 1}):
+        path = mirror_path(mirror_dir, article["image_url"])
+        if path is None:
+            missing += 1
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            digest = ingest_image(db, data)
+        except InvalidImage as e:
+            report("{}: {}".format(path, e))
+            missing += 1
+            continue
+        db.articles.update_one({"_id": article["_id"]},
+                               {"$set": {"image_id": digest}})
+        converted += 1
+    return converted, missing
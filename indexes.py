@@ -0,0 +1,140 @@
+"""
+Index management and query plan audit for the collections run.py uses.
+
+ensure_indexes() creates every index the routes rely on and is safe to
+run repeatedly. audit_queries() explains each route's query shape and
+reports collection scans and in-memory sorts.
+"""
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from topic_refs import topic_match
+
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True,
+                   name="username_unique"),
+    ],
+    "articles": [
+        IndexModel([("created_by", ASCENDING), ("_id", DESCENDING)],
+                   name="created_by_id"),
+        IndexModel([("topic_name", ASCENDING), ("_id", DESCENDING)],
+                   name="topic_name_id"),
+        IndexModel([("topic_id", ASCENDING), ("_id", DESCENDING)],
+                   name="topic_id_id"),
+        # Faceted browsing, equality then sort then range: topic with a
+        # date range uses topic_id_id and a date range alone uses _id
+        IndexModel([("topic_id", ASCENDING), ("location_name", ASCENDING),
+                    ("_id", DESCENDING), ("date_key", ASCENDING)],
+                   name="topic_id_location_id_date"),
+        IndexModel([("location_name", ASCENDING), ("_id", DESCENDING),
+                    ("date_key", ASCENDING)],
+                   name="location_id_date"),
+        IndexModel([("views", DESCENDING)], name="views",
+                   partialFilterExpression={"views": {"$gt": 0}}),
+        IndexModel([("article_name", TEXT), ("article_article", TEXT),
+                    ("topic_name", TEXT)],
+                   name="article_text"),
+    ],
+    "further_reading": [
+        IndexModel([("topic_name", ASCENDING), ("_id", DESCENDING)],
+                   name="topic_name_id"),
+        IndexModel([("topic_id", ASCENDING), ("_id", DESCENDING)],
+                   name="topic_id_id"),
+    ],
+    "topics": [
+        IndexModel([("topic_name", ASCENDING)], name="topic_name"),
+    ],
+    # Shared rate limit buckets are dropped once they would be full again
+    "rate_limits": [
+        IndexModel([("expires", ASCENDING)], expireAfterSeconds=0,
+                   name="expires"),
+    ],
+    "locations": [
+        IndexModel([("location_name", ASCENDING)], name="location_name"),
+    ],
+}
+
+# (route, collection, filter, sort) for every indexed query the routes run
+QUERY_SHAPES = [
+    ("login/registration", "users", {"username": "audit"}, None),
+    ("profile", "articles", {"created_by": "audit"}, [("_id", -1)]),
+    ("filter_topics", "articles",
+     topic_match({"_id": ObjectId(), "topic_name": "audit"}), [("_id", -1)]),
+    ("topic stats", "articles", {"topic_name": "audit"}, [("_id", -1)]),
+    ("browse", "articles",
+     dict(topic_match({"_id": ObjectId(), "topic_name": "audit"}),
+          location_name="audit", date_key={"$gte": "2020-01-01"}),
+     [("_id", -1)]),
+    ("browse", "articles",
+     dict(topic_match({"_id": ObjectId(), "topic_name": "audit"}),
+          date_key={"$gte": "2020-01-01"}),
+     [("_id", -1)]),
+    ("browse", "articles", {"location_name": "audit",
+                            "date_key": {"$lte": "2020-12-31"}},
+     [("_id", -1)]),
+    ("browse", "articles", {"date_key": {"$lte": "2020-12-31"}},
+     [("_id", -1)]),
+    ("search", "articles", {"$text": {"$search": "audit"}}, None),
+    ("filter_reading", "further_reading",
+     topic_match({"_id": ObjectId(), "topic_name": "audit"}),
+     [("_id", -1)]),
+    ("sorted topics", "topics", {}, [("topic_name", 1)]),
+    ("sorted locations", "locations", {}, [("location_name", 1)]),
+]
+
+# Plan stages that mean a query is not served by an index
+PROBLEM_STAGES = {"COLLSCAN", "SORT"}
+
+
+def ensure_indexes(db):
+    """
+    Creates any missing indexes and returns a list of
+    (collection, error message) pairs for those that failed, for
+    example a unique index over duplicate usernames.
+    """
+    errors = []
+    for name, models in INDEXES.items():
+        for model in models:
+            try:
+                db[name].create_indexes([model])
+            except OperationFailure as e:
+                errors.append((name, str(e)))
+    return errors
+
+
+def plan_stages(plan):
+    """
+    Yields every stage name in an explain() plan tree.
+    """
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        yield from plan_stages(plan.get(key))
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+def audit_queries(db):
+    """
+    Explains each query shape and returns (route, collection, stages,
+    problems) tuples, where problems lists any COLLSCAN or in-memory
+    SORT stage in the winning plan.
+    """
+    results = []
+    for route, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        except OperationFailure as e:
+            results.append((route, collection, [], [str(e)]))
+            continue
+        stages = list(plan_stages(plan))
+        problems = [stage for stage in stages if stage in PROBLEM_STAGES]
+        results.append((route, collection, stages, problems))
+    return results
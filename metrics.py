@@ -0,0 +1,258 @@
+"""
+Per-request MongoDB and rendering instrumentation.
+
+A PyMongo CommandListener counts the commands each request issues, their
+latency, documents returned and reply size. Flask's template signals
+time rendering. Per-route histograms are exposed in the Prometheus text
+format on /metrics, and requests that go over a query count or time
+budget are logged as warnings.
+
+/metrics reveals per-route traffic and internal counters, so it only
+answers scrapers sending the METRICS_TOKEN config value as a bearer
+token, and is not served at all while no token is configured.
+"""
+import bisect
+import hmac
+import threading
+import time
+
+import bson
+from flask import (
+    Response, abort, before_render_template, current_app,
+    request, template_rendered)
+from pymongo import monitoring
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216)
+
+# Replies whose documents are counted as returned
+CURSOR_COMMANDS = ("find", "aggregate", "getMore")
+
+_current = threading.local()
+
+
+class Histogram:
+    """
+    Cumulative histogram of observations per label value.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, label_name):
+        lines = ["# HELP {} {}".format(self.name, self.help_text),
+                 "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            for label, (counts, total, count) in sorted(
+                    self._series.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket
+                    lines.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(
+                        self.name, label_name, label, bound, cumulative))
+                lines.append('{}_sum{{{}="{}"}} {}'.format(
+                    self.name, label_name, label, total))
+                lines.append('{}_count{{{}="{}"}} {}'.format(
+                    self.name, label_name, label, count))
+        return lines
+
+
+class RequestStats:
+    """
+    Counters collected for a single request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.command_seconds = 0.0
+        self.max_command_seconds = 0.0
+        self.documents = 0
+        self.bytes_received = 0
+        self.template_seconds = 0.0
+        self._render_started = None
+        self._lock = threading.Lock()
+
+    def command_finished(self, seconds, documents, size):
+        with self._lock:
+            self.commands += 1
+            self.command_seconds += seconds
+            self.max_command_seconds = max(self.max_command_seconds,
+                                           seconds)
+            self.documents += documents
+            self.bytes_received += size
+
+
+def current_stats():
+    """
+    Returns the stats object of the request running on this thread.
+    """
+    return getattr(_current, "stats", None)
+
+
+def activate(stats):
+    """
+    Attributes MongoDB commands run on this thread to stats, for work
+    done on behalf of a request outside its own thread.
+    """
+    _current.stats = stats
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Feeds command latency, documents and reply size into the stats of
+    the request that issued the command.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = current_stats()
+        if stats is None:
+            return
+        reply = event.reply
+        documents = 0
+        if event.command_name in CURSOR_COMMANDS:
+            cursor = reply.get("cursor", {})
+            documents = len(cursor.get("firstBatch",
+                                       cursor.get("nextBatch", [])))
+        stats.command_finished(event.duration_micros / 1e6, documents,
+                               len(bson.encode(reply)))
+
+    def failed(self, event):
+        stats = current_stats()
+        if stats is not None:
+            stats.command_finished(event.duration_micros / 1e6, 0, 0)
+
+
+class RequestMetrics:
+    """
+    Flask extension that collects per-route histograms and serves them
+    on /metrics.
+    """
+
+    def __init__(self, app=None):
+        self.listener = CommandTimer()
+        self.query_budget = None
+        self.time_budget_ms = None
+        self.gauges = {}
+        self.histograms = {
+            "commands": Histogram(
+                "mongo_commands_per_request",
+                "MongoDB commands issued per request", COUNT_BUCKETS),
+            "command_seconds": Histogram(
+                "mongo_command_seconds_per_request",
+                "Total MongoDB command latency per request",
+                SECONDS_BUCKETS),
+            "max_command_seconds": Histogram(
+                "mongo_slowest_command_seconds",
+                "Slowest MongoDB command per request", SECONDS_BUCKETS),
+            "documents": Histogram(
+                "mongo_documents_per_request",
+                "Documents returned by MongoDB per request", COUNT_BUCKETS),
+            "bytes_received": Histogram(
+                "mongo_reply_bytes_per_request",
+                "MongoDB reply bytes per request", SIZE_BUCKETS),
+            "template_seconds": Histogram(
+                "template_render_seconds",
+                "Template render time per request", SECONDS_BUCKETS),
+            "request_seconds": Histogram(
+                "request_seconds", "Wall time per request",
+                SECONDS_BUCKETS),
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.query_budget = app.config.get("MONGO_QUERY_BUDGET")
+        self.time_budget_ms = app.config.get("MONGO_TIME_BUDGET_MS")
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        app.add_url_rule("/metrics", "metrics", self.render)
+
+    def gauge(self, name, help_text, getter):
+        """
+        Adds a value read at scrape time, such as cache counters.
+        """
+        self.gauges[name] = (help_text, getter)
+
+    def _start(self):
+        activate(RequestStats())
+
+    def _render_started(self, sender, **extra):
+        stats = current_stats()
+        if stats is not None:
+            stats._render_started = time.perf_counter()
+
+    def _render_finished(self, sender, **extra):
+        stats = current_stats()
+        if stats is not None and stats._render_started is not None:
+            stats.template_seconds += (time.perf_counter()
+                                       - stats._render_started)
+            stats._render_started = None
+
+    def _finish(self, error=None):
+        stats = current_stats()
+        activate(None)
+        if stats is None or request.endpoint in (None, "metrics", "static"):
+            return
+        self.record(request.endpoint, stats)
+
+    def record(self, route, stats):
+        """
+        Adds a finished request's stats to the route's histograms.
+        """
+        elapsed = time.perf_counter() - stats.started
+        for name, histogram in self.histograms.items():
+            value = elapsed if name == "request_seconds" else getattr(
+                stats, name)
+            histogram.observe(route, value)
+
+        over_queries = (self.query_budget is not None
+                        and stats.commands > int(self.query_budget))
+        over_time = (self.time_budget_ms is not None
+                     and stats.command_seconds * 1000
+                     > float(self.time_budget_ms))
+        if over_queries or over_time:
+            current_app.logger.warning(
+                "%s over MongoDB budget: %d commands, %.1f ms",
+                route, stats.commands, stats.command_seconds * 1000)
+
+    def render(self):
+        token = current_app.config.get("METRICS_TOKEN")
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(
+                request.headers.get("Authorization", ""),
+                "Bearer " + token):
+            abort(401)
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render("route"))
+        for name, (help_text, getter) in sorted(self.gauges.items()):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append("{} {}".format(name, getter()))
+        return Response("\n".join(lines) + "\n",
+                        mimetype="text/plain; version=0.0.4")
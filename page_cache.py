@@ -0,0 +1,162 @@
+"""
+Rendered page cache for anonymous GET requests.
+
+Pages are keyed by endpoint, URL arguments and the generation numbers of
+the content they are built from. The write routes bump those
+generations, so a cached page is never served after its data changed in
+this process; a TTL bounds staleness across workers. Responses carry a
+strong ETag and a matching If-None-Match is answered with 304 before the
+view runs. Streamed pages are passed through and cached once the whole
+body has been sent, unless it grew past MAX_STREAMED_BYTES, so that a
+large streamed listing is never held in memory. Requests with query
+arguments the cached views do not read bypass the cache, so junk
+arguments cannot fill it.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import (
+    g, make_response, request, session, stream_with_context)
+
+# Most pages kept and how long each is trusted
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL = 60
+# Largest streamed body buffered for caching
+MAX_STREAMED_BYTES = 256 * 1024
+# Query arguments the cached views read
+KEY_ARGS = frozenset(("page", "per_page", "after", "before", "topic",
+                      "location", "from", "to"))
+
+
+def cacheable_request():
+    """
+    True for GET requests from anonymous visitors with no flashed
+    messages waiting to be shown and only known query arguments.
+    """
+    return (request.method in ("GET", "HEAD")
+            and KEY_ARGS.issuperset(request.args)
+            and "user" not in session
+            and not session.get("_flashes"))
+
+
+def personal_response():
+    """
+    True when the page just rendered set a cookie or embeds this
+    visitor's CSRF token, so it must not be shared.
+    """
+    return session.modified or "csrf_token" in g
+
+
+class PageCache:
+    """
+    LRU cache of rendered page bodies plus the per-collection content
+    generation numbers used in its keys.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._generations = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self, *names):
+        """
+        Marks the named content as changed.
+        """
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def _key(self, names):
+        generations = tuple(self._generations.get(name, 0)
+                            for name in names)
+        return (request.endpoint,
+                tuple(sorted((request.view_args or {}).items())),
+                tuple(sorted(request.args.items(multi=True))),
+                generations)
+
+    def _lookup(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _store(self, key, page):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, page)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _tee(self, key, chunks, mimetype):
+        """
+        Passes a streamed body through unchanged and caches it once it
+        has been sent completely and without errors, if it is small
+        enough.
+        """
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if parts is not None:
+                part = (chunk if isinstance(chunk, bytes)
+                        else chunk.encode("utf-8"))
+                size += len(part)
+                parts.append(part)
+                if size > MAX_STREAMED_BYTES:
+                    parts = None
+            yield chunk
+        if parts is None or personal_response() or g.get("stream_failed"):
+            return
+        body = b"".join(parts)
+        self._store(key, (hashlib.sha1(body).hexdigest(), body, mimetype))
+
+    def cached(self, *names):
+        """
+        Decorates a view whose output depends only on the named
+        content and the request URL.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not cacheable_request():
+                    return view(*args, **kwargs)
+
+                with self._lock:
+                    key = self._key(names)
+                page = self._lookup(key)
+
+                if page is None:
+                    response = make_response(view(*args, **kwargs))
+                    if (response.status_code != 200
+                            or response.direct_passthrough):
+                        return response
+                    if response.is_streamed:
+                        # The tee checks the session once the body is
+                        # sent, so it needs the request context too
+                        response.response = stream_with_context(self._tee(
+                            key, response.response, response.mimetype))
+                        response.vary.add("Cookie")
+                        return response
+                    if personal_response():
+                        return response
+                    body = response.get_data()
+                    page = (hashlib.sha1(body).hexdigest(), body,
+                            response.mimetype)
+                    self._store(key, page)
+
+                etag, body, mimetype = page
+                response = make_response(body)
+                response.mimetype = mimetype
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = "no-cache"
+                response.vary.add("Cookie")
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
@@ -0,0 +1,181 @@
+"""
+Pagination helpers for article listings.
+
+Skip/limit and the document count are pushed down to MongoDB so that a
+page view only ever decodes the articles it actually displays. The
+flask_paginate Pagination object is still returned for the templates.
+Listings ordered newest first can also be paged by _id cursor with
+?after=<id> or ?before=<id>.
+
+Original list-slicing version credit: Ed Bradley
+@ https://github.com/Edb83/self-isolution/blob/master/app.py
+"""
+from bson.objectid import ObjectId
+from flask import request, url_for
+from flask_paginate import Pagination, get_page_args
+from markupsafe import Markup, escape
+
+# Articles pagination limit
+PER_PAGE = 6
+
+
+def page_number():
+    """
+    Returns the requested page number from the query string,
+    never lower than the first page.
+    """
+    page, per_page, offset = get_page_args(
+        page_parameter='page', per_page_parameter='per_page')
+    return max(page, 1)
+
+
+def count_documents(collection, query=None):
+    """
+    Counts the documents matching a query. An unfiltered count is
+    answered from collection metadata instead of scanning the
+    collection.
+    """
+    if not query:
+        return collection.estimated_document_count()
+    return collection.count_documents(query)
+
+
+def paginate_query(collection, query=None, sort=None, projection=None,
+                   per_page=PER_PAGE, gather=None):
+    """
+    Runs a find() for the current page only and returns the page of
+    documents together with a Pagination object for the template.
+    When a gather function is given the page and the count are
+    fetched concurrently.
+    """
+    query = query or {}
+    page = page_number()
+    offset = page * per_page - per_page
+
+    cursor = collection.find(query, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    cursor = cursor.skip(offset).limit(per_page)
+
+    if gather is None:
+        items = list(cursor)
+        total = count_documents(collection, query)
+    else:
+        items, total = gather(lambda: list(cursor),
+                              lambda: count_documents(collection, query))
+    pagination = Pagination(page=page, per_page=per_page, total=total)
+    return items, pagination
+
+
+class KeysetPagination:
+    """
+    Next/previous paging on the _id ordering used by the listings.
+    Exposes the same `links` attribute that templates read from the
+    flask_paginate Pagination object.
+    """
+
+    def __init__(self, has_prev, has_next, first_id, last_id):
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.first_id = first_id
+        self.last_id = last_id
+
+    def _url(self, **cursor):
+        args = request.args.to_dict()
+        for key in ("page", "after", "before"):
+            args.pop(key, None)
+        args.update(request.view_args or {})
+        args.update(cursor)
+        return url_for(request.endpoint, **args)
+
+    @property
+    def prev_url(self):
+        if not self.has_prev or self.first_id is None:
+            return None
+        return self._url(before=str(self.first_id))
+
+    @property
+    def next_url(self):
+        if not self.has_next or self.last_id is None:
+            return None
+        return self._url(after=str(self.last_id))
+
+    @property
+    def links(self):
+        items = []
+        for label, url in (("&laquo; Newer", self.prev_url),
+                           ("Older &raquo;", self.next_url)):
+            if url:
+                items.append('<li class="waves-effect"><a href="{}">{}</a>'
+                             '</li>'.format(escape(url), label))
+            else:
+                items.append('<li class="disabled"><a>{}</a></li>'
+                             .format(label))
+        return Markup('<ul class="pagination">{}</ul>'.format("".join(items)))
+
+
+def cursor_arg(name):
+    """
+    Returns the ObjectId passed as a paging cursor in the query string,
+    or None when it is missing or malformed.
+    """
+    value = request.args.get(name)
+    if not value or not ObjectId.is_valid(value):
+        return None
+    return ObjectId(value)
+
+
+def keyset_requested():
+    """
+    True when the request opts in to cursor paging with after/before.
+    """
+    return "after" in request.args or "before" in request.args
+
+
+def keyset_query(collection, query=None, projection=None,
+                 per_page=PER_PAGE):
+    """
+    Fetches one page newest first using an _id range rather than a
+    skip, so every page costs the same however deep it is. Documents
+    inserted meanwhile sort ahead of the cursor and so never shift
+    the later pages.
+    """
+    query = dict(query or {})
+    after = cursor_arg("after")
+    before = cursor_arg("before")
+
+    if before is not None:
+        query["_id"] = {"$gt": before}
+        direction = 1
+    else:
+        if after is not None:
+            query["_id"] = {"$lt": after}
+        direction = -1
+
+    items = list(collection.find(query, projection)
+                 .sort("_id", direction).limit(per_page + 1))
+    more = len(items) > per_page
+    items = items[:per_page]
+
+    if before is not None:
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+
+    first_id = items[0]["_id"] if items else None
+    last_id = items[-1]["_id"] if items else None
+    return items, KeysetPagination(has_prev, has_next, first_id, last_id)
+
+
+def paginate_listing(collection, query=None, projection=None,
+                     per_page=PER_PAGE, gather=None):
+    """
+    Pages a newest-first listing by cursor when after/before is given,
+    otherwise by page number.
+    """
+    if keyset_requested():
+        return keyset_query(collection, query, projection, per_page)
+    return paginate_query(collection, query, sort=[("_id", -1)],
+                          projection=projection, per_page=per_page,
+                          gather=gather)
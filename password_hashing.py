@@ -0,0 +1,81 @@
+"""
+Password hashing on a dedicated, size-limited executor.
+
+Hashing is CPU bound, so it runs on its own small thread pool (werkzeug's
+pbkdf2 and scrypt hashing release the GIL) with a cap on how many calls
+may wait. When the cap is reached HashingOverloaded is raised straight
+away so the route can answer 503 instead of every request slowing down.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 16
+DEFAULT_TIMEOUT = 10
+# Seconds clients are asked to wait before retrying when overloaded
+RETRY_AFTER = 2
+
+
+class HashingOverloaded(Exception):
+    """
+    Raised when the hashing queue is full or a hash took too long.
+    """
+
+
+def hash_method(stored_hash):
+    """
+    Returns the method part of a werkzeug hash, e.g. pbkdf2:sha256:600000.
+    """
+    return (stored_hash or "").split("$", 1)[0]
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords on a bounded executor using the
+    configured werkzeug method, e.g. "scrypt:32768:8:1" or
+    "pbkdf2:sha256:600000". No method means werkzeug's default.
+    """
+
+    def __init__(self, method=None, max_workers=DEFAULT_WORKERS,
+                 max_queue=DEFAULT_QUEUE, timeout=DEFAULT_TIMEOUT):
+        self.method = method or None
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="hashing")
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded("Too many password checks in progress")
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingOverloaded("Password hashing timed out")
+
+    def hash(self, password):
+        if self.method:
+            return self._run(generate_password_hash, password, self.method)
+        return self._run(generate_password_hash, password)
+
+    def check(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """
+        True when a stored hash was made with other parameters than
+        the configured method.
+        """
+        if not self.method:
+            return False
+        stored = hash_method(stored_hash)
+        return not (stored == self.method
+                    or stored.startswith(self.method + ":"))
@@ -0,0 +1,160 @@
+"""
+Write-behind article view counts and a precomputed popular list.
+
+Views are counted in memory per worker and flushed to MongoDB as one
+unordered bulk_write of $inc updates every few seconds, or sooner when
+many distinct articles are waiting. At most one flush interval of views
+is lost if a worker dies. The most viewed articles overall and per
+topic are recomputed on a schedule by a single aggregation, so pages
+can show them without querying.
+"""
+import atexit
+import os
+import threading
+import time
+
+from pymongo import UpdateOne
+
+DEFAULT_FLUSH_INTERVAL = 10
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_REFRESH_INTERVAL = 300
+# Articles kept in each popular list
+POPULAR_SIZE = 5
+
+POPULAR_PROJECTION = {"article_name": 1, "topic_name": 1, "topic_id": 1,
+                      "image_url": 1, "image_id": 1, "excerpt": 1,
+                      "views": 1}
+
+
+class ViewCounter:
+    """
+    Per-worker view counts waiting to be written.
+    """
+
+    def __init__(self, collection_getter, max_pending=DEFAULT_MAX_PENDING):
+        self._collection = collection_getter
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, article_id):
+        """
+        Counts one view. Returns True when enough distinct articles are
+        waiting that a flush should happen now.
+        """
+        with self._lock:
+            self._pending[article_id] = self._pending.get(article_id, 0) + 1
+            return len(self._pending) >= self.max_pending
+
+    def flush(self):
+        """
+        Writes all waiting counts in one bulk_write and returns how
+        many articles were updated. When the write fails the counts are
+        kept for the next flush and the error is raised.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self._collection().bulk_write(
+                [UpdateOne({"_id": article_id}, {"$inc": {"views": count}})
+                 for article_id, count in pending.items()],
+                ordered=False)
+        except Exception:
+            with self._lock:
+                for article_id, count in pending.items():
+                    self._pending[article_id] = (
+                        self._pending.get(article_id, 0) + count)
+            raise
+        return len(pending)
+
+
+class PopularArticles:
+    """
+    Most viewed articles overall and per topic, held in memory.
+    """
+
+    def __init__(self, collection_getter, size=POPULAR_SIZE):
+        self._collection = collection_getter
+        self.size = size
+        self.overall = []
+        self.by_topic = {}
+
+    def refresh(self):
+        pipeline = [
+            {"$match": {"views": {"$gt": 0}}},
+            {"$project": POPULAR_PROJECTION},
+            # $topN keeps only the leaders of each topic while grouping
+            {"$group": {"_id": {"$ifNull": ["$topic_id", "$topic_name"]},
+                        "articles": {"$topN": {"n": self.size,
+                                               "sortBy": {"views": -1},
+                                               "output": "$$ROOT"}}}},
+        ]
+        by_topic = {group["_id"]: group["articles"] for group in
+                    self._collection().aggregate(pipeline, allowDiskUse=True)}
+        overall = sorted((article for articles in by_topic.values()
+                          for article in articles),
+                         key=lambda article: -article.get("views", 0))
+        # Swap in whole lists so readers never see a half-built ranking
+        self.by_topic = by_topic
+        self.overall = overall[:self.size]
+
+    def for_topic(self, topic):
+        """
+        Returns the list for a topic_id, or for a topic_name when its
+        articles are not yet migrated.
+        """
+        return self.by_topic.get(topic, [])
+
+
+class PopularityWorker:
+    """
+    Background thread that flushes view counts and refreshes the
+    popular lists. It is started on first use in each process, so it
+    survives pre-forking servers.
+    """
+
+    def __init__(self, counter, popular,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 logger=None):
+        self.counter = counter
+        self.popular = popular
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.logger = logger
+        self._pid = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            threading.Thread(target=self._run, name="popularity",
+                             daemon=True).start()
+            atexit.register(self.counter.flush)
+
+    def record_view(self, article_id):
+        self.ensure_started()
+        if self.counter.record(article_id):
+            self._wake.set()
+
+    def _run(self):
+        next_refresh = 0
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.counter.flush()
+                if time.monotonic() >= next_refresh:
+                    self.popular.refresh()
+                    next_refresh = time.monotonic() + self.refresh_interval
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception("Popularity update failed")
@@ -0,0 +1,94 @@
+"""
+Bounded LRU + TTL cache of search result id lists.
+
+Queries are normalized before they are used as keys so that trivially
+different spellings of a popular query share one entry. Any article
+write bumps the cache generation, which empties it.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Most queries kept and how long each result list is trusted
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 60
+
+STOP_WORDS = frozenset("""
+    a an and are as at be by for from has in is it its of on or that the
+    to was were will with
+""".split())
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """
+    Case-folds a query, collapses whitespace and drops stop words.
+    A query made only of stop words is kept as it is.
+    """
+    words = WHITESPACE_RE.sub(" ", (query or "").casefold()).strip().split()
+    kept = [word for word in words if word not in STOP_WORDS]
+    return " ".join(kept or words)
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with per-entry expiry and hit, miss and
+    eviction counters.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+
+        value = loader()
+        with self._lock:
+            # A write while loading may have made this result stale
+            if generation == self.generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def bump(self):
+        """
+        Starts a new generation, discarding every cached result.
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,207 @@
+"""
+Token-bucket rate limiting and load shedding for the expensive routes.
+
+Each rule is a bucket of `burst` requests refilled at `rate` per second,
+kept per client IP or per submitted username. Buckets live in a
+pluggable storage: MemoryStorage for a single process, or MongoStorage
+to share them between workers and servers, which works against a local
+mongod as well as the production cluster.
+
+Client IPs come from request.remote_addr. Behind a reverse proxy or
+load balancer, set TRUSTED_PROXIES so run.py applies ProxyFix and the
+address is taken from X-Forwarded-For; otherwise every client would
+share the proxy's bucket.
+
+A per-process cap on concurrently running limited requests sheds the
+rest with 503 so cheap pages still get a thread. Both checks run before
+the view, so a shed request never reaches its queries or password
+hashing.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import request
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+DEFAULT_MAX_KEYS = 100000
+# Seconds clients are asked to wait when every slot is busy
+OVERLOAD_RETRY_AFTER = 1
+
+
+class Shed(Exception):
+    """
+    Raised when a request is refused: 429 when a client is over its
+    rate, 503 when the server is at its concurrency cap.
+    """
+
+    def __init__(self, status, retry_after):
+        super().__init__(status, retry_after)
+        self.status = status
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+def client_ip():
+    return request.remote_addr
+
+
+def form_username():
+    username = (request.form.get("username") or "").strip().lower()
+    return username or None
+
+
+# name: label used in bucket keys; key: returns the value to count by,
+# or None to skip the rule for this request
+Rule = namedtuple("Rule", "name rate burst key")
+
+SEARCH_RULES = (Rule("ip", 2, 20, client_ip),)
+LOGIN_RULES = (Rule("ip", 10 / 60, 10, client_ip),
+               Rule("username", 5 / 60, 5, form_username))
+REGISTRATION_RULES = (Rule("ip", 5 / 600, 5, client_ip),)
+
+
+class MemoryStorage:
+    """
+    Buckets in a bounded in-process LRU map. Evicting a bucket only
+    forgets an idle client, which then starts with a full bucket.
+    """
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """
+        Takes one token from a bucket. Returns (allowed, seconds until a
+        token is available).
+        """
+        with self._lock:
+            tokens, at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + max(now - at, 0) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class MongoStorage:
+    """
+    Buckets as documents updated atomically by one pipeline update, so
+    every worker sees the same counts. A TTL index on `expires` removes
+    buckets once they would be full again.
+    """
+
+    def __init__(self, collection_getter):
+        self._collection = collection_getter
+
+    def take(self, key, rate, burst, now):
+        elapsed = {"$max": [0, {"$subtract": [
+            now, {"$ifNull": ["$at", now]}]}]}
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        update = [
+            {"$set": {"tokens": refilled, "at": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$allowed",
+                                           {"$subtract": ["$tokens", 1]},
+                                           "$tokens"]},
+                      "expires": datetime.fromtimestamp(
+                          now + burst / rate, timezone.utc)}},
+        ]
+        try:
+            bucket = self._collection().find_one_and_update(
+                {"_id": key}, update, upsert=True,
+                return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # Two first requests raced to create the bucket; the other
+            # one won, so this update finds it
+            bucket = self._collection().find_one_and_update(
+                {"_id": key}, update, upsert=True,
+                return_document=ReturnDocument.AFTER)
+        if bucket["allowed"]:
+            return True, 0
+        return False, (1 - bucket["tokens"]) / rate
+
+
+def make_storage(name, collection_getter):
+    """
+    Returns the bucket storage configured by name, falling back to
+    in-process memory for unknown names.
+    """
+    if name == "mongo":
+        return MongoStorage(collection_getter)
+    return MemoryStorage()
+
+
+class RateLimiter:
+    """
+    Route decorator applying a concurrency cap and rate rules, with
+    counters of shed requests per endpoint.
+    """
+
+    def __init__(self, storage, max_concurrent=None, enabled=True):
+        self.storage = storage
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self._slots = (threading.BoundedSemaphore(max_concurrent)
+                       if max_concurrent else None)
+        self.stats = {"rate_limited": 0, "overloaded": 0}
+        self._lock = threading.Lock()
+
+    def _shed(self, reason, status, retry_after):
+        with self._lock:
+            self.stats[reason] += 1
+            name = "{}_{}".format(request.endpoint, reason)
+            self.stats[name] = self.stats.get(name, 0) + 1
+        raise Shed(status, retry_after)
+
+    def check(self, rules):
+        """
+        Takes a token from every rule's bucket for this request, raising
+        Shed with the longest wait when any of them is empty.
+        """
+        now = time.time()
+        wait = 0
+        for rule in rules:
+            value = rule.key()
+            if value is None:
+                continue
+            key = "{}:{}:{}".format(request.endpoint, rule.name, value)
+            allowed, retry_after = self.storage.take(key, rule.rate,
+                                                     rule.burst, now)
+            if not allowed:
+                wait = max(wait, retry_after)
+        if wait:
+            self._shed("rate_limited", 429, wait)
+
+    def limit(self, *rules, methods=None):
+        """
+        Limits a view to the given rules, for the given HTTP methods
+        only when methods is set.
+        """
+        def decorator(view):
+            @wraps(view)
+            def limited(*args, **kwargs):
+                if not self.enabled or (methods and
+                                        request.method not in methods):
+                    return view(*args, **kwargs)
+                if self._slots is None:
+                    self.check(rules)
+                    return view(*args, **kwargs)
+                if not self._slots.acquire(blocking=False):
+                    self._shed("overloaded", 503, OVERLOAD_RETRY_AFTER)
+                try:
+                    self.check(rules)
+                    return view(*args, **kwargs)
+                finally:
+                    self._slots.release()
+            return limited
+        return decorator
@@ -0,0 +1,56 @@
+"""
+In-process cache for small, rarely changing reference data such as the
+sorted topics and locations lists.
+
+Entries are dropped straight away when the owning collection is written
+from this process. The TTL is a backstop so that other workers pick up
+the change within a bounded time.
+"""
+import threading
+import time
+
+# Seconds a cached entry is trusted without being reloaded
+DEFAULT_TTL = 300
+
+
+class ReferenceCache:
+    """
+    Thread-safe key/value cache whose values are produced by a loader
+    callable on a miss and expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() to fill the
+        entry when it is missing or expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            generation = self._generation
+
+        value = loader()
+        with self._lock:
+            # Skip storing a value loaded across an invalidation
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Drops the given keys, or every entry when no key is given.
+        """
+        with self._lock:
+            self._generation += 1
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
@@ -1,23 +1,64 @@
 import os
+import click
 from flask import (
-    Flask, flash, render_template,
+    Flask, Response, abort, flash, jsonify, render_template,
     redirect, request, session, url_for)
 from flask_pymongo import PyMongo
-from flask_paginate import Pagination, get_page_args
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask_paginate import Pagination
 from bson.objectid import ObjectId
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf.csrf import CSRFProtect, validate_csrf, ValidationError
 from wtforms import (
     Form, TextField,
     PasswordField, validators)
 from wtforms.validators import InputRequired, EqualTo
+from assets import StaticAssets, build_assets
+from article_summary import (
+    SUMMARY_PROJECTION, backfill_summaries, summary_fields)
+from bulk_io import (
+    DEFAULT_BATCH_SIZE, SCHEMAS, export_collection, import_collection)
+from compression import (
+    DEFAULT_LEVEL, DEFAULT_MIN_SIZE, CompressionMiddleware)
+from facets import (
+    backfill_date_keys, browse, date_fields, date_key, location_facets,
+    topic_facets)
+from fanout import DEFAULT_TIMEOUT, DEFAULT_WORKERS, Fanout
+from images import (
+    IMMUTABLE, InvalidImage, backfill_images, ingest_image, open_variant)
+from indexes import audit_queries, ensure_indexes
+from metrics import RequestMetrics
+from page_cache import PageCache
+from pagination import (
+    PER_PAGE, keyset_query, page_number, paginate_listing)
+from password_hashing import (
+    DEFAULT_QUEUE, DEFAULT_WORKERS as HASH_WORKERS, RETRY_AFTER,
+    HashingOverloaded, PasswordHasher)
+from ratelimit import (
+    LOGIN_RULES, REGISTRATION_RULES, SEARCH_RULES, RateLimiter, Shed,
+    make_storage)
+from reference_cache import DEFAULT_TTL, ReferenceCache
+from popularity import (
+    DEFAULT_FLUSH_INTERVAL, DEFAULT_REFRESH_INTERVAL,
+    PopularArticles, PopularityWorker, ViewCounter)
+from query_cache import QueryCache
+from search import make_search_backend
+from serving import (
+    open_connections, pool_options, thread_count, worker_count)
+from suggest import (
+    DEFAULT_LIMIT, MAX_LIMIT, SuggestionIndex, suggestion_sources)
+from streaming import STREAM_BATCH_SIZE, stream_page
+from topic_refs import (
+    COLLECTIONS, current_topic_names, migrate_topic_ids, rename_topic,
+    sync_topic_names, topic_key, topic_match)
+from topic_stats import (
+    record_article_added, record_article_moved,
+    record_article_removed, rebuild_topic_stats)
+from user_stats import (
+    PUBLIC_PROJECTION, rebuild_user_stats, record_user_article)
 
 if os.path.exists("env.py"):
     import env
 
-# Articles pagination limit
-PER_PAGE = 6
-
 # Flask app setup
 app = Flask(__name__)
 csrf = CSRFProtect(app)
@@ -27,44 +68,429 @@ csrf.init_app(app)
 app.config["MONGO_DBNAME"] = os.environ.get("MONGO_DBNAME")
 app.config["MONGO_URI"] = os.environ.get("MONGO_URI")
 app.secret_key = os.environ.get("SECRET_KEY")
+# Largest accepted upload, which bounds image uploads
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.environ.get("MAX_CONTENT_LENGTH", 10 * 1024 * 1024))
+# "mongo" for the $text index or "memory" for the in-process index
+app.config["SEARCH_BACKEND"] = os.environ.get("SEARCH_BACKEND", "mongo")
+# Log a warning for requests over these MongoDB budgets
+app.config["MONGO_QUERY_BUDGET"] = os.environ.get("MONGO_QUERY_BUDGET")
+app.config["MONGO_TIME_BUDGET_MS"] = os.environ.get("MONGO_TIME_BUDGET_MS")
+# Bearer token Prometheus sends to scrape /metrics, which is off unset
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+
+
+metrics = RequestMetrics(app)
+assets = StaticAssets(app)
+
+# Compress responses unless COMPRESSION_LEVEL is 0
+compression = CompressionMiddleware(
+    app.wsgi_app,
+    level=int(os.environ.get("COMPRESSION_LEVEL", DEFAULT_LEVEL)),
+    min_size=int(os.environ.get("COMPRESSION_MIN_SIZE", DEFAULT_MIN_SIZE)))
+if compression.level > 0:
+    app.wsgi_app = compression
+# Number of reverse proxies in front of the app whose X-Forwarded-*
+# headers are trusted, so client addresses are the real ones
+trusted_proxies = int(os.environ.get("TRUSTED_PROXIES", 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies,
+                            x_proto=trusted_proxies)
+for counter in ("responses", "bytes_in", "bytes_out", "cpu_seconds"):
+    metrics.gauge("compression_" + counter,
+                  "Compressed response " + counter.replace("_", " "),
+                  lambda counter=counter: compression.stats[counter])
+
+# MongoDB pools are sized from the serving profile. The client made here
+# does not connect, so a pre-forking server can import this module
+# safely; create_app() replaces it in each worker after the fork.
+fanout_workers = int(os.environ.get("FANOUT_WORKERS", DEFAULT_WORKERS))
+mongo_pool = pool_options(worker_count(), thread_count(), fanout_workers)
+mongo = PyMongo(app, connect=False, event_listeners=[metrics.listener],
+                **mongo_pool)
+
+# Password hashing runs on its own bounded pool; PASSWORD_HASH_METHOD
+# takes a werkzeug method such as "pbkdf2:sha256:600000"
+password_hasher = PasswordHasher(
+    method=os.environ.get("PASSWORD_HASH_METHOD"),
+    max_workers=int(os.environ.get("HASH_WORKERS", HASH_WORKERS)),
+    max_queue=int(os.environ.get("HASH_QUEUE", DEFAULT_QUEUE)))
+
+# Shared pool for running a request's independent reads in parallel
+fanout = Fanout(
+    max_workers=fanout_workers,
+    pool_size=mongo_pool["maxPoolSize"],
+    timeout=float(os.environ.get("FANOUT_TIMEOUT", DEFAULT_TIMEOUT)))
+
+reference_cache = ReferenceCache(
+    ttl=int(os.environ.get("REFERENCE_CACHE_TTL", DEFAULT_TTL)))
+
+# Short-lived cache of user documents for profile pages
+user_cache = ReferenceCache(
+    ttl=int(os.environ.get("USER_CACHE_TTL", 30)))
+
+page_cache = PageCache(
+    ttl=int(os.environ.get("PAGE_CACHE_TTL", 60)))
+
+search_cache = QueryCache(
+    max_entries=int(os.environ.get("SEARCH_CACHE_SIZE", 256)),
+    ttl=int(os.environ.get("SEARCH_CACHE_TTL", 60)))
+
+for counter in ("hits", "misses", "evictions", "entries"):
+    metrics.gauge("search_cache_" + counter,
+                  "Search result cache " + counter,
+                  lambda counter=counter: search_cache.stats()[counter])
+
+# Facet counts per browse filter combination
+facet_cache = QueryCache(
+    max_entries=int(os.environ.get("FACET_CACHE_SIZE", 256)),
+    ttl=int(os.environ.get("FACET_CACHE_TTL", 60)))
+
+search_backend = make_search_backend(app.config["SEARCH_BACKEND"],
+                                     lambda: mongo.db.articles,
+                                     search_cache)
+
+# Sheds /search, /login and /registration traffic before any work
+# starts. RATE_LIMIT_STORAGE=mongo shares the buckets between workers;
+# by default one request thread per worker is kept for other pages.
+limiter = RateLimiter(
+    make_storage(os.environ.get("RATE_LIMIT_STORAGE", "memory"),
+                 lambda: mongo.db.rate_limits),
+    max_concurrent=int(os.environ.get("RATE_LIMIT_MAX_CONCURRENT",
+                                      max(thread_count() - 1, 1))),
+    enabled=os.environ.get("RATE_LIMIT_ENABLED", "1") == "1")
+for endpoint in ("", "search_", "login_", "registration_"):
+    for reason in ("rate_limited", "overloaded"):
+        counter = endpoint + reason
+        metrics.gauge("shed_" + counter,
+                      "Requests shed as " + counter.replace("_", " "),
+                      lambda counter=counter: limiter.stats.get(counter, 0))
+
+# Typeahead over article and topic names
+suggestions = SuggestionIndex(lambda: suggestion_sources(mongo.db))
+
+# Article views are counted in memory and flushed in bulk
+popularity = PopularityWorker(
+    ViewCounter(lambda: mongo.db.articles),
+    PopularArticles(lambda: mongo.db.articles),
+    flush_interval=float(os.environ.get(
+        "VIEW_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+    refresh_interval=float(os.environ.get(
+        "POPULAR_REFRESH_INTERVAL", DEFAULT_REFRESH_INTERVAL)),
+    logger=app.logger)
+
+
+# Process that owns the current MongoClient
+app_pid = None
+
+
+def create_app():
+    """
+    Returns the app with a MongoClient owned by the calling process,
+    warmed up before it serves anything. Call it in each worker after
+    forking; gunicorn.conf.py does so from its post_fork hook.
+    """
+    global app_pid
+    if app_pid != os.getpid():
+        app_pid = os.getpid()
+        mongo.cx.close()
+        mongo.init_app(app, event_listeners=[metrics.listener], **mongo_pool)
+        warm_up()
+    return app
 
 
-mongo = PyMongo(app)
+def warm_up():
+    """
+    Opens the pool's minimum connections and primes the caches that the
+    first requests would otherwise fill.
+    """
+    try:
+        open_connections(mongo.cx, mongo_pool["minPoolSize"], fanout.gather)
+        if os.environ.get("ENSURE_INDEXES"):
+            ensure_indexes(mongo.db)
+        fanout.gather(sorted_topics, sorted_locations,
+                      search_backend.warm_up, suggestions.ensure_built,
+                      popularity.popular.refresh)
+    except Exception:
+        app.logger.exception("Warmup failed")
 
-# Pagination
-"""Credit: Ed Bradley\
-@ https://github.com/Edb83/self-isolution/blob/master/app.py
-"""
+
+def sorted_topics():
+    """
+    Returns all topics sorted by name from the reference data cache.
+    """
+    return reference_cache.get("topics", lambda: list(
+        mongo.db.topics.find().sort("topic_name", 1)))
 
 
-def paginate(articles):
-    page, per_page, offset = get_page_args(
-        page_parameter='page', per_page_parameter='per_page')
-    offset = page * PER_PAGE - PER_PAGE
-    return articles[offset: offset + PER_PAGE]
+def sorted_locations():
+    """
+    Returns all locations sorted by name from the reference data cache.
+    """
+    return reference_cache.get("locations", lambda: list(
+        mongo.db.locations.find().sort("location_name", 1)))
 
 
-def pagination_args(articles):
-    page, per_page, offset = get_page_args(
-        page_parameter='page', per_page_parameter='per_page')
-    total = len(articles)
-    return Pagination(page=page, per_page=PER_PAGE, total=total)
+def find_topic(topic_id):
+    """
+    Looks a topic up by id in the cached topics list, only going to
+    the database when it is not there.
+    """
+    for topic in sorted_topics():
+        if str(topic["_id"]) == str(topic_id):
+            return topic
+    return mongo.db.topics.find_one({"_id": ObjectId(topic_id)})
 
 
-"""
-End Credit
-"""
+def topic_id_for(topic_name):
+    """
+    Returns the id of the topic with the given name, or None. Topics
+    created since the cached list was loaded are looked up in the
+    database.
+    """
+    for topic in sorted_topics():
+        if topic["topic_name"] == topic_name:
+            return topic["_id"]
+    topic = mongo.db.topics.find_one({"topic_name": topic_name}, {"_id": 1})
+    return topic["_id"] if topic else None
+
+
+def find_user(username):
+    """
+    Returns a user's public fields from the short-lived user cache.
+    """
+    return user_cache.get(username, lambda: mongo.db.users.find_one(
+        {"username": username}, PUBLIC_PROJECTION))
+
+
+def store_uploaded_image(fields):
+    """
+    Ingests an image uploaded with an article form and records its id
+    on the article fields. Returns False when the upload is not a
+    readable image.
+    """
+    upload = request.files.get("image_file")
+    if not upload or not upload.filename:
+        return True
+    try:
+        fields["image_id"] = ingest_image(mongo.db, upload.read())
+    except InvalidImage:
+        flash("The uploaded image could not be read")
+        return False
+    return True
+
+
+@app.template_global()
+def article_image(article, variant="card", extension="webp"):
+    """
+    Returns the URL of an article's stored image variant, falling
+    back to its external image_url.
+    """
+    if article.get("image_id"):
+        return url_for("image", digest=article["image_id"],
+                       variant=variant, extension=extension)
+    return article.get("image_url")
+
+
+def topic_article_lists(topics):
+    """
+    Maps each topic name to the ids of its most recent articles, as
+    kept on the topic documents by the article write routes.
+    """
+    return {topic["topic_name"]: topic.get("article_list", [])
+            for topic in topics}
+
+
+# CLI commands run in their own process, so they cannot reach the caches
+# of running workers. Those pick up the changes once their caches expire
+# (REFERENCE_CACHE_TTL, USER_CACHE_TTL, PAGE_CACHE_TTL, SEARCH_CACHE_TTL
+# and FACET_CACHE_TTL); the in-memory search index and the suggestions
+# are only rebuilt on a restart, so restart the workers after an import
+# or sync-topic-names.
+@app.cli.command("rebuild-topic-stats")
+def rebuild_topic_stats_command():
+    """
+    Recomputes the per-topic article counts and recent article lists.
+    """
+    updated = rebuild_topic_stats(mongo.db)
+    print("Rebuilt article stats for {} topics".format(updated))
+
+
+@app.cli.command("migrate-topic-ids")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+def migrate_topic_ids_command(batch_size):
+    """
+    Backfills topic_id on articles and further reading written before
+    topics were referenced by id. Safe to interrupt and run again.
+    """
+    results = migrate_topic_ids(mongo.db, batch_size)
+    rebuild_topic_stats(mongo.db)
+    orphaned = sum(result[1] for result in results.values())
+    if orphaned:
+        print("{} documents name a topic that no longer exists".format(
+            orphaned))
+
+
+@app.cli.command("sync-topic-names")
+def sync_topic_names_command():
+    """
+    Stores renamed topics' current names on their articles and further
+    reading, so that search finds them by the new name.
+    """
+    sync_topic_names(mongo.db)
+
+
+@app.cli.command("rebuild-user-stats")
+def rebuild_user_stats_command():
+    """
+    Recomputes every user's article count.
+    """
+    updated = rebuild_user_stats(mongo.db)
+    print("Rebuilt article counts for {} users".format(updated))
+
+
+@app.cli.command("backfill-summaries")
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--refresh", is_flag=True,
+              help="Recompute summaries that already exist.")
+def backfill_summaries_command(batch_size, refresh):
+    """
+    Stores excerpts and word counts on existing articles.
+    """
+    updated = backfill_summaries(mongo.db, batch_size, refresh)
+    print("Stored summaries for {} articles".format(updated))
+
+
+@app.cli.command("backfill-date-keys")
+@click.option("--batch-size", default=500, show_default=True)
+def backfill_date_keys_command(batch_size):
+    """
+    Stores the normalized date_key used by date filters on existing
+    articles.
+    """
+    updated = backfill_date_keys(mongo.db, batch_size)
+    print("Stored date keys for {} articles".format(updated))
+
+
+@app.cli.command("backfill-images")
+@click.argument("mirror_dir", type=click.Path(exists=True, file_okay=False))
+def backfill_images_command(mirror_dir):
+    """
+    Stores local copies of article image_url files from a mirror
+    directory as resized variants.
+    """
+    converted, missing = backfill_images(mongo.db, mirror_dir)
+    print("Converted {} images, {} not found".format(converted, missing))
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """
+    Fingerprints and precompresses the static files.
+    """
+    manifest = build_assets(app.static_folder)
+    assets.load()
+    print("Built {} static assets".format(len(manifest)))
+
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """
+    Creates the indexes the routes rely on.
+    """
+    errors = ensure_indexes(mongo.db)
+    for collection, error in errors:
+        print("{}: {}".format(collection, error))
+    if errors:
+        raise SystemExit(1)
+    print("Indexes are up to date")
+
+
+@app.cli.command("audit-queries")
+def audit_queries_command():
+    """
+    Explains each route's query and flags collection scans and
+    in-memory sorts.
+    """
+    failed = False
+    for route, collection, stages, problems in audit_queries(mongo.db):
+        status = "FAIL " + ", ".join(problems) if problems else "ok"
+        print("{:<20} {:<16} {:<40} {}".format(
+            route, collection, " > ".join(stages), status))
+        failed = failed or bool(problems)
+    if failed:
+        raise SystemExit(1)
+
+
+@app.cli.command("export-ndjson")
+@click.argument("collection", type=click.Choice(sorted(SCHEMAS)))
+@click.argument("path", type=click.File("w"), default="-")
+def export_ndjson_command(collection, path):
+    """
+    Streams a collection out as NDJSON.
+    """
+    count = export_collection(mongo.db, collection, path)
+    click.echo("Exported {} {}".format(count, collection), err=True)
+
+
+@app.cli.command("import-ndjson")
+@click.argument("collection", type=click.Choice(sorted(SCHEMAS)))
+@click.argument("path", type=click.File("r"), default="-")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option("--upsert", is_flag=True,
+              help="Replace documents with the same natural key.")
+@click.option("--checkpoint", type=click.Path(dir_okay=False),
+              help="File recording progress so the import can resume.")
+def import_ndjson_command(collection, path, batch_size, upsert, checkpoint):
+    """
+    Streams NDJSON into a collection in batches.
+    """
+    totals = import_collection(mongo.db, collection, path, batch_size,
+                               upsert, checkpoint,
+                               lambda message: click.echo(message, err=True))
+    if collection in COLLECTIONS or collection == "topics":
+        migrate_topic_ids(mongo.db, batch_size,
+                          lambda message: click.echo(message, err=True))
+    if collection in ("articles", "topics"):
+        # Imported topics start with empty stats
+        rebuild_topic_stats(mongo.db)
+    if collection == "articles":
+        rebuild_user_stats(mongo.db)
+    click.echo("Imported {written}, invalid {invalid}, "
+               "failed {failed}".format(**totals), err=True)
 
 
 @app.route("/")
 @app.route("/index")
+@page_cache.cached("articles", "topics")
 def index():
     """
     Links to home page when using the main website link
     """
-    articles = mongo.db.articles.find()
-    return render_template("index.html",
-                           articles=articles)
+    popularity.ensure_started()
+    articles = current_topic_names(mongo.db.articles.find(
+        {}, SUMMARY_PROJECTION).batch_size(STREAM_BATCH_SIZE),
+        sorted_topics())
+    return stream_page("index.html",
+                       articles=articles,
+                       popular=popularity.popular.overall)
+
+
+@app.route("/images/<digest>/<variant>.<extension>")
+def image(digest, variant, extension):
+    """
+    Serves a stored image variant. The URL names the image content, so
+    it may be cached forever.
+    """
+    stored = open_variant(mongo.db, digest, variant, extension)
+    if stored is None:
+        abort(404)
+
+    response = Response(stored, mimetype=stored.content_type)
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.content_length = stored.length
+    response.set_etag("{}-{}-{}".format(digest, variant, extension))
+    return response.make_conditional(request)
 
 
 @app.route("/contact", methods=["GET", "POST"])
@@ -76,24 +502,20 @@ def contact():
 
 
 @app.route("/articles")
+@page_cache.cached("articles", "topics")
 def articles():
     """
     Links articles from database to site and displays all
     articles
     """
-    articles = list(mongo.db.articles.find())
-    articles_paginate = paginate(articles)
-    pagination = pagination_args(articles)
-    topic = mongo.db.topics.find()
-    topic_name = list(mongo.db.topics.find().sort("topic_name", 1))
-
-    topics = {}
-    for article in articles:
-        if article["topic_name"] in topics:
-            topics["article"].append(article._id)
-        else:
-            print(article["_id"])
-            topics["article_id"] = article["_id"]
+    (articles_paginate, pagination), topic = fanout.gather(
+        lambda: paginate_listing(mongo.db.articles,
+                                 projection=SUMMARY_PROJECTION,
+                                 gather=fanout.gather),
+        sorted_topics)
+    articles_paginate = list(current_topic_names(articles_paginate, topic))
+    topic_name = topic
+    topics = topic_article_lists(topic)
 
     return render_template("articles.html",
                            articles=articles_paginate,
@@ -101,20 +523,83 @@ def articles():
                            pagination=pagination,
                            topic=topic,
                            topics=topics,
-                           topic_name=topic_name,
-                           article=article)
+                           topic_name=topic_name)
+
+
+@app.route("/browse")
+@page_cache.cached("articles", "topics")
+def browse_articles():
+    """
+    Filters articles by any mix of topic, location and date range and
+    shows how many matching articles each topic and location has.
+    """
+    topic_id = request.args.get("topic")
+    topic_id = ObjectId(topic_id) if ObjectId.is_valid(topic_id) else None
+    location = request.args.get("location") or None
+    date_from = date_key(request.args.get("from"))
+    date_to = date_key(request.args.get("to"))
+    page = page_number()
+
+    topics = sorted_topics()
+    topic = None
+    if topic_id is not None:
+        topic = next((topic for topic in topics
+                      if topic["_id"] == topic_id), None)
+        if topic is None:
+            abort(404)
+
+    (articles_paginate, counts), locations = fanout.gather(
+        lambda: browse(mongo.db.articles, topic, location, date_from,
+                       date_to, page, cache=facet_cache),
+        sorted_locations)
+    articles_paginate = list(current_topic_names(articles_paginate, topics))
+    pagination = Pagination(page=page, per_page=PER_PAGE,
+                            total=counts["total"])
+
+    return render_template("articles.html",
+                           articles=articles_paginate,
+                           page_title="Browse Articles",
+                           pagination=pagination,
+                           topics=topics,
+                           topic_facets=topic_facets(counts, topics),
+                           location_facets=location_facets(counts,
+                                                           locations),
+                           filters=request.args)
+
+
+@app.route("/article/<article_id>")
+def article(article_id):
+    """
+    Displays a single article in full and counts the view.
+    """
+    if not ObjectId.is_valid(article_id):
+        abort(404)
+    article = mongo.db.articles.find_one({"_id": ObjectId(article_id)})
+    if article is None:
+        abort(404)
+
+    popularity.record_view(article["_id"])
+    return render_template("article.html",
+                           article=article,
+                           page_title=article["article_name"])
 
 
 @app.route("/search",  methods=["GET", "POST"])
+@limiter.limit(*SEARCH_RULES, methods=("GET",))
 def search():
     """
     Returns search results from user input query based on indexes
     of article name, article content and topic name.
     """
-    query = request.form.get("query")
-    articles = list(mongo.db.articles.find({"$text": {"$search": query}}))
-    articles_paginate = paginate(articles)
-    pagination = pagination_args(articles)
+    if request.method == "POST":
+        # Results live at a GET URL so the page links keep the query
+        return redirect(url_for("search",
+                                query=request.form.get("query", "")))
+
+    query = request.args.get("query", "")
+    articles_paginate, pagination = search_backend.page(query)
+    articles_paginate = list(current_topic_names(articles_paginate,
+                                                 sorted_topics()))
 
     return render_template("articles.html",
                            articles=articles_paginate,
@@ -122,6 +607,57 @@ def search():
                            pagination=pagination)
 
 
+@app.route("/suggest")
+def suggest():
+    """
+    Returns article and topic names matching the typed prefix as JSON
+    for the search box, best matches first.
+    """
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    matches = suggestions.suggest(request.args.get("q", ""),
+                                  max(1, min(limit, MAX_LIMIT)))
+    response = jsonify([{
+        "label": label,
+        "type": kind,
+        "url": (url_for("article", article_id=item_id)
+                if kind == "article"
+                else url_for("filter_topics", topic_id=item_id)),
+    } for kind, item_id, label in matches])
+    # Names change rarely, so browsers may reuse answers briefly
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return response
+
+
+@app.route("/search/cache_stats")
+def search_cache_stats():
+    """
+    Reports search result cache size and hit, miss and eviction
+    counters to the admin as JSON.
+    """
+    if session.get("user", "").lower() != "admin":
+        flash("You are not authorized to view this page")
+        return redirect(url_for("login"))
+
+    return jsonify(search_cache.stats())
+
+
+def rehash_password(user, password):
+    """
+    Upgrades a user's stored hash to the configured method after a
+    successful login. Skipped when hashing is busy; it will be retried
+    on a later login.
+    """
+    if not password_hasher.needs_rehash(user["password"]):
+        return
+    try:
+        new_hash = password_hasher.hash(password)
+    except HashingOverloaded:
+        return
+    mongo.db.users.update_one(
+        {"_id": user["_id"], "password": user["password"]},
+        {"$set": {"password": new_hash}})
+
+
 """
 The below code was taken from
 https://wtforms.readthedocs.io/en/stable/crash_course/
@@ -170,6 +706,7 @@ class RegistrationForm(Form):
 
 
 @app.route("/registration", methods=["GET", "POST"])
+@limiter.limit(*REGISTRATION_RULES, methods=("POST",))
 def registration():
     """
     Allows users to sign up to the site, create an account profile
@@ -189,7 +726,7 @@ def registration():
             signup = {
                 "username": request.form.get("username").lower(),
                 "email": request.form.get("email").lower(),
-                "password": generate_password_hash(
+                "password": password_hasher.hash(
                     request.form.get("password"))
             }
             mongo.db.users.insert_one(signup)
@@ -200,11 +737,15 @@ def registration():
 
         return render_template('sign-up.html', form=form)
 
+    except HashingOverloaded:
+        raise
+
     except Exception as e:
         return (str(e))
 
 
 @app.route("/login", methods=["GET", "POST"])
+@limiter.limit(*LOGIN_RULES, methods=("POST",))
 def login():
     """
     Allows users to login and access their profile 
@@ -217,9 +758,10 @@ def login():
             {"username": request.form.get("username").lower()})
 
         if existing_user:
-            if check_password_hash(
+            if password_hasher.check(
                     existing_user["password"], request.form.get("password")):
                 session["user"] = request.form.get("username").lower()
+                rehash_password(existing_user, request.form.get("password"))
 
                 flash("Welcome back {}!".format(
                     request.form.get("username")))
@@ -244,16 +786,20 @@ def profile(username):
     displays all the user's contributions upon successful
     log in.
     """
-    username = mongo.db.users.find_one(
-        {"username": session["user"]})["username"]
-    articles = list(mongo.db.articles.find(
-        {"created_by": session["user"]}).sort("_id", -1))
+    if not session.get("user"):
+        return redirect(url_for("login"))
 
-    if session["user"]:
-        return render_template("profile.html", username=username,
-                               articles=articles)
+    username = session["user"]
+    user = find_user(username) or {}
+    articles, pagination = keyset_query(
+        mongo.db.articles, {"created_by": username},
+        projection=SUMMARY_PROJECTION)
+    articles = list(current_topic_names(articles, sorted_topics()))
 
-    return redirect(url_for("login"))
+    return render_template("profile.html", username=username,
+                           articles=articles,
+                           pagination=pagination,
+                           article_count=user.get("article_count", 0))
 
 
 @app.route("/logout")
@@ -275,8 +821,7 @@ def add_article():
     with their own unique articles and stores articles
     in MongoDB articles collection.
     """
-    topics = mongo.db.topics.find().sort("topic_name", 1)
-    locations = mongo.db.locations.find().sort("location_name", 1)
+    topics, locations = fanout.gather(sorted_topics, sorted_locations)
 
     if "user" not in session:
         flash("Please Log in to continue")
@@ -287,6 +832,7 @@ def add_article():
     else:
         article = {
             "topic_name": request.form.get("topic_name"),
+            "topic_id": topic_id_for(request.form.get("topic_name")),
             "article_name": request.form.get("article_name"),
             "image_url": request.form.get("image_url"),
             "article_article": request.form.get("article_article"),
@@ -294,7 +840,21 @@ def add_article():
             "created_by": session["user"],
             "date_added": request.form.get("date_added")
         }
-        mongo.db.articles.insert_one(article)
+        article.update(summary_fields(article["article_article"]))
+        article.update(date_fields(article["date_added"]))
+        if not store_uploaded_image(article):
+            return redirect(url_for("add_article"))
+        inserted = mongo.db.articles.insert_one(article)
+        record_article_added(mongo.db, topic_key(article),
+                             inserted.inserted_id)
+        record_user_article(mongo.db, article["created_by"], 1)
+        user_cache.invalidate(article["created_by"])
+        reference_cache.invalidate("topics")
+        search_backend.article_saved(article)
+        suggestions.put("article", inserted.inserted_id,
+                        article["article_name"])
+        facet_cache.bump()
+        page_cache.bump("articles")
         flash("Article contribution successful!")
         return redirect(url_for("articles"))
 
@@ -308,9 +868,9 @@ def edit_article(article_id):
     Allows users to edit their contributions to the site
     and updates the articles collection in MongoDB.
     """
-    article = mongo.db.articles.find_one({"_id": ObjectId(article_id)})
-    topics = mongo.db.topics.find().sort("topic_name", 1)
-    locations = mongo.db.locations.find().sort("location_name", 1)
+    article, topics, locations = fanout.gather(
+        lambda: mongo.db.articles.find_one({"_id": ObjectId(article_id)}),
+        sorted_topics, sorted_locations)
     article_creator = article["created_by"]
 
     if "user" not in session:
@@ -328,6 +888,7 @@ def edit_article(article_id):
     else:
         adjust = {
             "topic_name": request.form.get("topic_name"),
+            "topic_id": topic_id_for(request.form.get("topic_name")),
             "article_name": request.form.get("article_name"),
             "image_url": request.form.get("image_url"),
             "article_article": request.form.get("article_article"),
@@ -335,7 +896,30 @@ def edit_article(article_id):
             "created_by": session["user"],
             "date_added": request.form.get("date_added")
         }
-        mongo.db.articles.update({"_id": ObjectId(article_id)}, adjust)
+        adjust.update(summary_fields(adjust["article_article"]))
+        adjust.update(date_fields(adjust["date_added"]))
+        if not store_uploaded_image(adjust):
+            return redirect(url_for("edit_article", article_id=article_id))
+        update = {"$set": adjust}
+        # A stored image wins over image_url, so drop it when the URL
+        # is changed or the remove_image box is ticked
+        if "image_id" not in adjust and (
+                request.form.get("remove_image")
+                or adjust["image_url"] != article.get("image_url")):
+            update["$unset"] = {"image_id": ""}
+        mongo.db.articles.update_one({"_id": ObjectId(article_id)}, update)
+        record_article_moved(mongo.db, topic_key(article),
+                             topic_key(adjust), article["_id"])
+        if adjust["created_by"] != article_creator:
+            record_user_article(mongo.db, article_creator, -1)
+            record_user_article(mongo.db, adjust["created_by"], 1)
+            user_cache.invalidate(article_creator, adjust["created_by"])
+        reference_cache.invalidate("topics")
+        search_backend.article_saved(dict(adjust, _id=article["_id"]))
+        suggestions.put("article", article["_id"], adjust["article_name"],
+                        article.get("views", 0))
+        facet_cache.bump()
+        page_cache.bump("articles")
         flash("Article update successful!")
 
     return redirect(url_for("articles"))
@@ -348,7 +932,9 @@ def delete_article(article_id):
     and removes the specific article from the articles collection in
     MongoDB.
     """
-    article = mongo.db.articles.find_one({"_id": ObjectId(article_id)})
+    article = mongo.db.articles.find_one({"_id": ObjectId(article_id)},
+                                         {"created_by": 1, "topic_name": 1,
+                                          "topic_id": 1})
     article_creator = article["created_by"]
 
     if "user" not in session:
@@ -361,6 +947,15 @@ def delete_article(article_id):
 
     else:
         mongo.db.articles.remove({"_id": ObjectId(article_id)})
+        record_article_removed(mongo.db, topic_key(article),
+                               article["_id"])
+        record_user_article(mongo.db, article_creator, -1)
+        user_cache.invalidate(article_creator)
+        reference_cache.invalidate("topics")
+        search_backend.article_deleted(article["_id"])
+        suggestions.remove("article", article["_id"])
+        facet_cache.bump()
+        page_cache.bump("articles")
         flash("Article successfully deleted.")
         return redirect(url_for("articles"))
 
@@ -376,16 +971,9 @@ def topics():
         return redirect(url_for("login"))
 
     else:
-        topics = list(mongo.db.topics.find().sort("topic_name", 1))
-        topic_name = list(mongo.db.topics.find())
-        article_list = {}
-
-        for topic in topics:
-            if topic["topic_name"] in topics:
-                topic["article_list"].append(topic._id)
-            else:
-                print(topic["_id"])
-                topic["topic_id"] = topic["_id"]
+        topics = sorted_topics()
+        topic_name = topics
+        article_list = topic_article_lists(topics)
 
         return render_template("topics.html",
                                topics=topics,
@@ -400,17 +988,22 @@ def filter_topics(topic_id):
     to only show articles with the same topic
     name.
     """
-    topics = list(mongo.db.topics.find())
-    topic = mongo.db.topics.find_one({"_id": ObjectId(topic_id)})
-    articles = list(mongo.db.articles.find(
-        {"topic_name": topic["topic_name"]}).sort("_id", -1))
-    pagination = pagination_args(articles)
-    articles_paginate = paginate(articles)
+    topics, topic = fanout.gather(sorted_topics,
+                                  lambda: find_topic(topic_id))
+    articles_paginate, pagination = paginate_listing(
+        mongo.db.articles, topic_match(topic),
+        projection=SUMMARY_PROJECTION, gather=fanout.gather)
+    articles_paginate = list(current_topic_names(articles_paginate, topics))
+
+    popularity.ensure_started()
+    popular = (popularity.popular.for_topic(topic["_id"])
+               or popularity.popular.for_topic(topic["topic_name"]))
 
     return render_template("articles.html",
                            articles=articles_paginate,
                            topic=topic,
                            topics=topics,
+                           popular=popular,
                            page_title=topic["topic_name"],
                            pagination=pagination)
 
@@ -421,7 +1014,7 @@ def add_topic():
     Allows Admin to add more topics to the site 
     and MongoDB as they see fit.
     """
-    topics = mongo.db.topics.find().sort("topic_name", 1)
+    topics = sorted_topics()
 
     if "user" not in session:
         flash("Please Log in to continue")
@@ -438,10 +1031,13 @@ def add_topic():
     else:
         topic = {
             "topic_name": request.form.get("topic_name"),
-            "article_list": [""]
-
+            "article_count": 0,
+            "article_list": []
         }
-        mongo.db.topics.insert_one(topic)
+        inserted = mongo.db.topics.insert_one(topic)
+        suggestions.put("topic", inserted.inserted_id, topic["topic_name"])
+        reference_cache.invalidate("topics")
+        page_cache.bump("topics")
         flash("Topic contribution successful!")
         return redirect(url_for("topics"))
 
@@ -470,10 +1066,15 @@ def edit_topic(topic_id):
 
     else:
         adjust = {
-            "topic_name": request.form.get("topic_name"),
-            "article_list": []
+            "topic_name": request.form.get("topic_name")
         }
-        mongo.db.topics.update({"_id": ObjectId(topic_id)}, adjust)
+        rename_topic(mongo.db, topic, adjust["topic_name"])
+        suggestions.put("topic", topic["_id"], adjust["topic_name"],
+                        topic.get("article_count", 0))
+        reference_cache.invalidate("topics")
+        # Pages show the new name through current_topic_names; search
+        # matches it once sync-topic-names has run
+        page_cache.bump("topics", "articles", "further_reading")
         flash("Topic update successful!")
 
     return redirect(url_for("topics"))
@@ -498,21 +1099,27 @@ def delete_topic(topic_id):
 
     else:
         mongo.db.topics.remove({"_id": ObjectId(topic_id)})
+        suggestions.remove("topic", ObjectId(topic_id))
+        reference_cache.invalidate("topics")
+        page_cache.bump("topics")
         flash("Topic successfully deleted.")
         return redirect(url_for("topics", topic=topic))
 
 
 @app.route("/further_reading")
+@page_cache.cached("further_reading", "topics")
 def further_reading():
     """
     Displays external reading source information and links
     to the further_reading collection in the database.
     """
-    further_reading = list(mongo.db.further_reading.find())
+    further_reading = current_topic_names(
+        mongo.db.further_reading.find().batch_size(STREAM_BATCH_SIZE),
+        sorted_topics())
 
-    return render_template("further_reading.html",
-                           page_title="Further Reading",
-                           further_reading=further_reading)
+    return stream_page("further_reading.html",
+                       page_title="Further Reading",
+                       further_reading=further_reading)
 
 
 @app.route("/add_further_reading", methods=["GET", "POST"])
@@ -522,7 +1129,7 @@ def add_further_reading():
     sources information to the site and the further_reading
     collection in the database as they see appropriate. 
     """
-    topics = mongo.db.topics.find().sort("topic_name", 1)
+    topics = sorted_topics()
 
     if "user" not in session:
         flash("Please Log in to continue")
@@ -537,6 +1144,7 @@ def add_further_reading():
     else:
         reading = {
             "topic_name": request.form.get("topic_name"),
+            "topic_id": topic_id_for(request.form.get("topic_name")),
             "book_title": request.form.get("book_title"),
             "website": request.form.get("website"),
             "article_title": request.form.get("article_title"),
@@ -545,6 +1153,7 @@ def add_further_reading():
             "publisher": request.form.get("publisher"),
         }
         mongo.db.further_reading.insert_one(reading)
+        page_cache.bump("further_reading")
         flash("Further Reading contribution successful!")
         return redirect(url_for("topics"))
 
@@ -561,7 +1170,7 @@ def edit_further_reading(reading_id):
     as they see fit.
     """
     reading = mongo.db.further_reading.find_one({"_id": ObjectId(reading_id)})
-    topics = mongo.db.topics.find().sort("topic_name", 1)
+    topics = sorted_topics()
 
     if "user" not in session:
         flash("Please Log in to continue")
@@ -577,6 +1186,7 @@ def edit_further_reading(reading_id):
     else:
         adjust = {
             "topic_name": request.form.get("topic_name"),
+            "topic_id": topic_id_for(request.form.get("topic_name")),
             "book_title": request.form.get("book_title"),
             "website": request.form.get("website"),
             "article_title": request.form.get("article_title"),
@@ -585,6 +1195,7 @@ def edit_further_reading(reading_id):
             "publisher": request.form.get("publisher"),
         }
         mongo.db.further_reading.update({"_id": ObjectId(reading_id)}, adjust)
+        page_cache.bump("further_reading")
         flash("Material update successful!")
 
     return redirect(url_for("topics"))
@@ -609,27 +1220,53 @@ def delete_further_reading(reading_id):
         return redirect(url_for("topics"))
     else:
         mongo.db.further_reading.remove({"_id": ObjectId(reading_id)})
+        page_cache.bump("further_reading")
         flash("Material successfully deleted.")
         return redirect(url_for("topics", reading=reading))
 
 
 @app.route("/filter_reading/further_reading/<topic_id>")
+@page_cache.cached("further_reading", "topics")
 def filter_reading(topic_id):
     """
     Filters further reading based on topic
     so that when it is displayed to the user
     it is relevant to the topic they have clicked on.
     """
-    topics = list(mongo.db.topics.find())
-    topic = mongo.db.topics.find_one({"_id": ObjectId(topic_id)})
+    topics = sorted_topics()
+    topic = find_topic(topic_id)
 
-    further_reading = list(mongo.db.further_reading.find(
-        {"topic_name": topic["topic_name"]}).sort("_id", -1))
-    return render_template("further_reading.html",
-                           further_reading=further_reading,
-                           topic=topic,
-                           topics=topics,
-                           page_title="Further Reading")
+    further_reading = current_topic_names(mongo.db.further_reading.find(
+        topic_match(topic)).sort("_id", -1).batch_size(
+            STREAM_BATCH_SIZE), topics)
+    return stream_page("further_reading.html",
+                       further_reading=further_reading,
+                       topic=topic,
+                       topics=topics,
+                       page_title="Further Reading")
+
+
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded(error):
+    """
+    Sheds login and sign-up requests while password hashing is
+    saturated instead of queueing them.
+    """
+    return ("The site is busy, please try again shortly.", 503,
+            {"Retry-After": str(RETRY_AFTER)})
+
+
+@app.errorhandler(Shed)
+def request_shed(error):
+    """
+    Refuses a request that is over its client's rate or arrived while
+    the server is at its concurrency cap.
+    """
+    if error.status == 429:
+        message = "Too many requests, please try again shortly."
+    else:
+        message = "The site is busy, please try again shortly."
+    return message, error.status, {"Retry-After": str(error.retry_after)}
 
 
 # @app.errorhandler(500)
@@ -642,8 +1279,8 @@ def filter_reading(topic_id):
 # return render_template('404.html'), 404
 
 
-# Change to False before submission
+# Development server only; production runs gunicorn -c gunicorn.conf.py
 if __name__ == "__main__":
-    app.run(host=os.environ.get("IP"),
-            port=int(os.environ.get("PORT")),
-            debug=True)
\ No newline at end of file
+    create_app().run(host=os.environ.get("IP"),
+                     port=int(os.environ.get("PORT")),
+                     debug=os.environ.get("FLASK_DEBUG") == "1")
\ No newline at end of file
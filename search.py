@@ -0,0 +1,293 @@
+"""
+Search backends for the /search route.
+
+MongoTextSearch runs the original $text query. MemorySearch keeps an
+in-process inverted index over article_name, article_article and
+topic_name with BM25 ranking and prefix matching. Both cache the ranked
+result ids per normalized query and only fetch the articles on the
+requested page from the database.
+"""
+import bisect
+import math
+import re
+import threading
+from collections import Counter
+
+from flask_paginate import Pagination
+
+from article_summary import SUMMARY_PROJECTION
+from pagination import PER_PAGE, page_number
+from query_cache import QueryCache, normalize_query
+
+# Fields indexed for each article and how much a match in each counts
+FIELD_WEIGHTS = {
+    "article_name": 3,
+    "topic_name": 2,
+    "article_article": 1,
+}
+
+# BM25 tuning constants
+K1 = 1.2
+B = 0.75
+
+# Most index terms a single query word may expand to by prefix
+MAX_PREFIX_TERMS = 50
+
+# Score multiplier for a prefix match compared to an exact match
+PREFIX_WEIGHT = 0.5
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Splits text into lower case word tokens.
+    """
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class InvertedIndex:
+    """
+    Term -> {article id: weighted term frequency} postings with a
+    sorted term list for prefix lookups. All methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._terms = []
+        self._doc_lengths = {}
+        self._doc_terms = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def rebuild(self, articles):
+        """
+        Replaces the whole index with the given article documents.
+        """
+        with self._lock:
+            self._postings = {}
+            self._terms = []
+            self._doc_lengths = {}
+            self._doc_terms = {}
+            self._total_length = 0
+            for article in articles:
+                self.add(article)
+
+    def add(self, article):
+        """
+        Indexes an article document, replacing any earlier version.
+        """
+        doc_id = article["_id"]
+        frequencies = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(article.get(field)):
+                frequencies[token] += weight
+
+        with self._lock:
+            self.remove(doc_id)
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    bisect.insort(self._terms, term)
+                postings[doc_id] = frequency
+            self._doc_terms[doc_id] = list(frequencies)
+            length = sum(frequencies.values())
+            self._doc_lengths[doc_id] = length
+            self._total_length += length
+
+    def remove(self, doc_id):
+        """
+        Drops an article from the index if it is present.
+        """
+        with self._lock:
+            length = self._doc_lengths.pop(doc_id, None)
+            if length is None:
+                return
+            self._total_length -= length
+            for term in self._doc_terms.pop(doc_id, []):
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+                    index = bisect.bisect_left(self._terms, term)
+                    del self._terms[index]
+
+    def _prefix_terms(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        for term in self._terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query):
+        """
+        Returns the ids of all matching articles, best match first.
+        """
+        scores = Counter()
+        with self._lock:
+            count = len(self._doc_lengths)
+            if not count:
+                return []
+            average_length = self._total_length / count
+
+            for word in set(tokenize(query)):
+                for term in self._prefix_terms(word):
+                    weight = 1.0 if term == word else PREFIX_WEIGHT
+                    postings = self._postings[term]
+                    idf = math.log(
+                        1 + (count - len(postings) + 0.5)
+                        / (len(postings) + 0.5))
+                    for doc_id, frequency in postings.items():
+                        norm = K1 * (1 - B + B * self._doc_lengths[doc_id]
+                                     / average_length)
+                        scores[doc_id] += (weight * idf * frequency
+                                           * (K1 + 1) / (frequency + norm))
+
+        return [doc_id for doc_id, score in sorted(
+            scores.items(), key=lambda item: (-item[1], str(item[0])))]
+
+
+class SearchBackend:
+    """
+    Shared paging for the backends: the ranked id list for a query is
+    kept in the query cache and only the ids on the requested page are
+    fetched from the articles collection.
+    """
+
+    def __init__(self, collection_getter, cache=None):
+        self._collection = collection_getter
+        self.cache = cache or QueryCache()
+
+    def ids(self, query):
+        raise NotImplementedError
+
+    def page(self, query, per_page=PER_PAGE):
+        key = normalize_query(query)
+        ids = self.cache.get(key, lambda: self.ids(key)) if key else []
+        page = page_number()
+        offset = page * per_page - per_page
+        page_ids = ids[offset: offset + per_page]
+
+        articles = []
+        if page_ids:
+            found = {article["_id"]: article for article in
+                     self._collection().find({"_id": {"$in": page_ids}},
+                                             SUMMARY_PROJECTION)}
+            articles = [found[doc_id] for doc_id in page_ids
+                        if doc_id in found]
+        return articles, Pagination(page=page, per_page=per_page,
+                                    total=len(ids))
+
+    def article_saved(self, article):
+        self.cache.bump()
+
+    def article_deleted(self, article_id):
+        self.cache.bump()
+
+    def warm_up(self):
+        """
+        Prepares the backend before a worker takes its first search.
+        """
+
+    def reset(self):
+        """
+        Forgets everything derived from the articles collection, for
+        use after bulk changes.
+        """
+        self.cache.bump()
+
+
+class MongoTextSearch(SearchBackend):
+    """
+    Searches with the MongoDB text index on the articles collection,
+    best text score first.
+    """
+
+    def ids(self, query):
+        score = {"score": {"$meta": "textScore"}}
+        cursor = self._collection().find(
+            {"$text": {"$search": query}}, dict(score, _id=1))
+        return [article["_id"] for article in
+                cursor.sort([("score", {"$meta": "textScore"})])]
+
+
+class MemorySearch(SearchBackend):
+    """
+    Searches an in-process inverted index that is built from the
+    articles collection on first use and then kept current by the
+    article write routes.
+    """
+
+    def __init__(self, collection_getter, cache=None):
+        super().__init__(collection_getter, cache)
+        self.index = InvertedIndex()
+        self._built = False
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        """
+        (Re)builds the whole index from the articles collection.
+        """
+        with self._build_lock:
+            self._load()
+        self.cache.bump()
+
+    def warm_up(self):
+        self.ensure_built()
+
+    def ensure_built(self):
+        if not self._built:
+            with self._build_lock:
+                if not self._built:
+                    self._load()
+
+    def _load(self):
+        projection = {field: 1 for field in FIELD_WEIGHTS}
+        self.index.rebuild(self._collection().find({}, projection))
+        self._built = True
+
+    def reset(self):
+        with self._build_lock:
+            self._built = False
+        super().reset()
+
+    def ids(self, query):
+        self.ensure_built()
+        return self.index.search(query)
+
+    def article_saved(self, article):
+        # Writes made while the index is loading wait for it, so the
+        # first build can never miss them
+        with self._build_lock:
+            if self._built:
+                self.index.add(article)
+        super().article_saved(article)
+
+    def article_deleted(self, article_id):
+        with self._build_lock:
+            if self._built:
+                self.index.remove(article_id)
+        super().article_deleted(article_id)
+
+
+BACKENDS = {
+    "mongo": MongoTextSearch,
+    "memory": MemorySearch,
+}
+
+
+def make_search_backend(name, collection_getter, cache=None):
+    """
+    Returns the search backend configured by name, falling back to
+    MongoDB $text search for unknown names.
+    """
+    backend = BACKENDS.get((name or "mongo").lower(), MongoTextSearch)
+    return backend(collection_getter, cache)
@@ -0,0 +1,73 @@
+"""
+Production serving profile.
+
+Worker and thread counts come from the environment and are shared by
+gunicorn.conf.py and the app, so every worker's MongoDB pool is sized
+for the concurrency it will actually see: one connection per request
+thread plus the fan-out pool, never more than its share of
+MONGO_MAX_CONNECTIONS across all workers.
+
+The MongoClient is created in each worker after the fork, not in the
+pre-forking master, and warm_up() opens its minimum connections before
+the worker starts accepting requests, so a deploy does not open every
+connection at once on the first requests.
+"""
+import os
+
+DEFAULT_THREADS = 4
+# Connections kept open for monitoring and stray background reads
+POOL_HEADROOM = 2
+
+DEFAULT_CONNECT_TIMEOUT_MS = 5000
+DEFAULT_SERVER_SELECTION_TIMEOUT_MS = 5000
+DEFAULT_WAIT_QUEUE_TIMEOUT_MS = 2000
+DEFAULT_MAX_IDLE_TIME_MS = 300000
+
+
+def worker_count():
+    """
+    Returns WEB_CONCURRENCY, or two workers per core plus one.
+    """
+    workers = os.environ.get("WEB_CONCURRENCY")
+    if workers:
+        return max(int(workers), 1)
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def thread_count():
+    """
+    Returns the request threads per worker from GUNICORN_THREADS.
+    """
+    return max(int(os.environ.get("GUNICORN_THREADS", DEFAULT_THREADS)), 1)
+
+
+def pool_options(workers, threads, fanout_workers):
+    """
+    Returns the MongoClient pool and timeout options for one worker.
+    """
+    max_pool = threads + fanout_workers + POOL_HEADROOM
+    limit = os.environ.get("MONGO_MAX_CONNECTIONS")
+    if limit:
+        max_pool = max(min(max_pool, int(limit) // workers), 1)
+    return {
+        "maxPoolSize": max_pool,
+        "minPoolSize": min(threads, max_pool),
+        "maxIdleTimeMS": int(os.environ.get(
+            "MONGO_MAX_IDLE_TIME_MS", DEFAULT_MAX_IDLE_TIME_MS)),
+        "connectTimeoutMS": int(os.environ.get(
+            "MONGO_CONNECT_TIMEOUT_MS", DEFAULT_CONNECT_TIMEOUT_MS)),
+        "serverSelectionTimeoutMS": int(os.environ.get(
+            "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+            DEFAULT_SERVER_SELECTION_TIMEOUT_MS)),
+        "waitQueueTimeoutMS": int(os.environ.get(
+            "MONGO_WAIT_QUEUE_TIMEOUT_MS", DEFAULT_WAIT_QUEUE_TIMEOUT_MS)),
+    }
+
+
+def open_connections(client, count, gather):
+    """
+    Opens up to count pooled connections by pinging concurrently.
+    """
+    def ping():
+        return client.admin.command("ping")
+    gather(*[ping] * max(count, 1))
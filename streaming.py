@@ -0,0 +1,46 @@
+"""
+Streamed rendering for pages that list a whole collection.
+
+The template is rendered while the MongoDB cursor is iterated, so the
+first bytes go out before the last documents are fetched and memory use
+stays flat however long the list grows. An error part way through can
+no longer change the status code, so it is logged, a short notice ends
+the page and g.stream_failed is set so the page cache skips it.
+
+The session cookie is written before the body is iterated, so session
+changes made while rendering would be lost. The CSRF token is generated
+and the flashed messages are popped before the response is returned;
+templates calling csrf_token() or get_flashed_messages() get the same
+values back.
+"""
+from flask import (
+    Response, current_app, g, get_flashed_messages, stream_template,
+    stream_with_context)
+from flask_wtf.csrf import generate_csrf
+
+# Documents fetched from MongoDB per round trip while streaming
+STREAM_BATCH_SIZE = 100
+
+STREAM_ERROR = ('<p class="stream-error">Sorry, the rest of this page '
+                'could not be loaded. Please try again.</p>')
+
+
+def stream_page(template_name, **context):
+    """
+    Returns a streamed response rendering template_name with context,
+    which also gets the flashed messages as flashed_messages.
+    """
+    generate_csrf()
+    context.setdefault("flashed_messages",
+                       get_flashed_messages(with_categories=True))
+
+    def generate():
+        try:
+            yield from stream_template(template_name, **context)
+        except Exception:
+            current_app.logger.exception(
+                "Error while streaming %s", template_name)
+            g.stream_failed = True
+            yield STREAM_ERROR
+
+    return Response(stream_with_context(generate()), mimetype="text/html")
@@ -0,0 +1,218 @@
+"""
+Typeahead suggestions for article and topic names.
+
+Every word-start suffix of each name is kept in one sorted list, so a
+prefix lookup is a bisect plus a scan of the matching range, and typing
+the start of any word in a name finds it. The ranges of prefixes up to
+SHORT_PREFIX letters are too large to scan per keystroke, so their
+ranked top results are kept as well. The index is built from MongoDB on
+first use and the article and topic write routes patch it in place.
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+# Prefixes up to this length keep their top MAX_LIMIT results
+SHORT_PREFIX = 3
+
+
+def normalize(text):
+    """
+    Case-folds a name or query and collapses its whitespace.
+    """
+    return " ".join((text or "").casefold().split())
+
+
+def word_suffixes(label):
+    """
+    Returns the normalized label starting from each of its words.
+    """
+    words = normalize(label).split()
+    return [" ".join(words[start:]) for start in range(len(words))]
+
+
+def suggestion_sources(db):
+    """
+    Yields (kind, id, label, score) for every article and topic, where
+    the score is an article's views or a topic's article count.
+    """
+    for article in db.articles.find({}, {"article_name": 1, "views": 1}):
+        yield ("article", article["_id"], article.get("article_name"),
+               article.get("views", 0))
+    for topic in db.topics.find({}, {"topic_name": 1, "article_count": 1}):
+        yield ("topic", topic["_id"], topic.get("topic_name"),
+               topic.get("article_count", 0))
+
+
+class SuggestionIndex:
+    """
+    Sorted (key, kind, id, word position) entries with the label and
+    score of each item, and the ranked top items of every short prefix.
+    All methods are thread-safe.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._entries = []
+        self._items = {}
+        self._top = {}
+        # Short prefixes whose top list must be recomputed before use
+        self._stale = set()
+        self._built = False
+        self._lock = threading.Lock()
+
+    def ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            self._entries = []
+            self._items = {}
+            candidates = {}
+            for kind, item_id, label, score in self._loader():
+                self._entries.extend(self._index(kind, item_id, label,
+                                                 score))
+                ref = (kind, str(item_id))
+                for prefix, rank in self._short_ranks(ref).items():
+                    candidates.setdefault(prefix, []).append(rank)
+            self._entries.sort()
+            self._top = {prefix: heapq.nsmallest(MAX_LIMIT, ranks)
+                         for prefix, ranks in candidates.items()}
+            self._stale = set()
+            self._built = True
+
+    def reset(self):
+        """
+        Drops the index so the next lookup rebuilds it, for use after
+        bulk changes.
+        """
+        with self._lock:
+            self._built = False
+            self._entries = []
+            self._items = {}
+            self._top = {}
+            self._stale = set()
+
+    def _index(self, kind, item_id, label, score):
+        ref = (kind, str(item_id))
+        self._items[ref] = (item_id, label, score or 0)
+        return [(key, kind, ref[1], position)
+                for position, key in enumerate(word_suffixes(label))]
+
+    def _rank(self, ref, position):
+        """
+        Sort key of an item for a prefix found at a word position:
+        names starting with it, then topics, then highest score.
+        """
+        label, score = self._items[ref][1:]
+        return (position > 0, ref[0] != "topic", -score, normalize(label),
+                ref)
+
+    def _short_ranks(self, ref):
+        ranks = {}
+        for position, key in enumerate(word_suffixes(self._items[ref][1])):
+            rank = self._rank(ref, position)
+            for length in range(1, min(SHORT_PREFIX, len(key)) + 1):
+                prefix = key[:length]
+                if prefix not in ranks or rank < ranks[prefix]:
+                    ranks[prefix] = rank
+        return ranks
+
+    def _scan(self, prefix):
+        """
+        Ranks every item with a word starting with prefix.
+        """
+        best = {}
+        entries = self._entries
+        for index in range(bisect_left(entries, (prefix,)), len(entries)):
+            key, kind, item_id, position = entries[index]
+            if not key.startswith(prefix):
+                break
+            ref = (kind, item_id)
+            best[ref] = min(position, best.get(ref, position))
+        return heapq.nsmallest(MAX_LIMIT, (self._rank(ref, position)
+                                           for ref, position in best.items()))
+
+    def _remove(self, ref):
+        """
+        Drops an item's entries and returns its short prefix ranks.
+        """
+        if ref not in self._items:
+            return {}
+        ranks = self._short_ranks(ref)
+        item = self._items.pop(ref)
+        for key in word_suffixes(item[1]):
+            index = bisect_left(self._entries, (key,) + ref)
+            if (index < len(self._entries)
+                    and self._entries[index][:3] == (key,) + ref):
+                del self._entries[index]
+        return ranks
+
+    def _update_top(self, ref, old, new):
+        """
+        Moves an item within the top lists of its short prefixes from
+        its old ranks to its new ones.
+        """
+        for prefix in set(old) | set(new):
+            if prefix in self._stale:
+                continue
+            top = self._top.setdefault(prefix, [])
+            full = len(top) >= MAX_LIMIT
+            listed = prefix in old and old[prefix] in top
+            if listed:
+                top.remove(old[prefix])
+            if prefix in new:
+                insort(top, new[prefix])
+                del top[MAX_LIMIT:]
+            if listed and full and (prefix not in new
+                                    or new[prefix] > old[prefix]):
+                # An item left out of the full list may now belong in it
+                self._stale.add(prefix)
+            elif not top:
+                del self._top[prefix]
+
+    def put(self, kind, item_id, label, score=0):
+        """
+        Adds an item or replaces its label and score. Writes made
+        before the index is built are picked up by the build.
+        """
+        with self._lock:
+            if not self._built:
+                return
+            ref = (kind, str(item_id))
+            old = self._remove(ref)
+            for entry in self._index(kind, item_id, label, score):
+                insort(self._entries, entry)
+            self._update_top(ref, old, self._short_ranks(ref))
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            if self._built:
+                ref = (kind, str(item_id))
+                self._update_top(ref, self._remove(ref), {})
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """
+        Returns up to limit (kind, id, label) items with a word starting
+        with query. Names that start with it come first, then topics
+        before articles, then the highest scores.
+        """
+        self.ensure_built()
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            if query in self._stale:
+                self._top[query] = self._scan(query)
+                self._stale.discard(query)
+            if len(query) <= SHORT_PREFIX:
+                ranked = self._top.get(query, [])[:limit]
+            else:
+                ranked = self._scan(query)[:limit]
+            items = self._items
+            return [(rank[-1][0], items[rank[-1]][0], items[rank[-1]][1])
+                    for rank in ranked]
@@ -0,0 +1,56 @@
+import io
+import time
+
+import pytest
+from flask import Flask, request
+
+from fanout import Fanout, FanoutTimeout
+from metrics import RequestMetrics
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["METRICS_TOKEN"] = "scraper"
+    metrics = RequestMetrics(app)
+    fanout = Fanout(max_workers=2)
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        image = request.files["image"]
+        fanout.gather(lambda: 1, lambda: 2, lambda: 3)
+        return image.read()
+
+    return app, metrics
+
+
+def test_gather_leaves_uploads_open():
+    app, metrics = make_app()
+    client = app.test_client()
+
+    response = client.post("/upload", data={
+        "image": (io.BytesIO(b"image bytes"), "photo.jpg")})
+
+    assert response.status_code == 200
+    assert response.data == b"image bytes"
+
+
+def test_gather_records_request_once():
+    app, metrics = make_app()
+    client = app.test_client()
+
+    client.post("/upload", data={
+        "image": (io.BytesIO(b"image bytes"), "photo.jpg")})
+
+    body = client.get("/metrics", headers={
+        "Authorization": "Bearer scraper"}).get_data(as_text=True)
+    assert 'request_seconds_count{route="upload"} 1' in body
+
+
+def test_timeout_counts_from_submission():
+    fanout = Fanout(max_workers=2, timeout=0.2)
+    started = time.monotonic()
+
+    with pytest.raises(FanoutTimeout):
+        fanout.gather(lambda: time.sleep(0.3), lambda: time.sleep(1))
+
+    assert time.monotonic() - started < 0.6
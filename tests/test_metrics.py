@@ -0,0 +1,26 @@
+from flask import Flask
+
+from metrics import RequestMetrics
+
+
+def make_client(token):
+    app = Flask(__name__)
+    app.config["METRICS_TOKEN"] = token
+    RequestMetrics(app)
+    return app.test_client()
+
+
+def test_metrics_off_without_token():
+    assert make_client(None).get("/metrics").status_code == 404
+
+
+def test_metrics_require_bearer_token():
+    client = make_client("scraper")
+
+    refused = client.get("/metrics", headers={
+        "Authorization": "Bearer guess"})
+    allowed = client.get("/metrics", headers={
+        "Authorization": "Bearer scraper"})
+
+    assert refused.status_code == 401
+    assert allowed.status_code == 200
@@ -0,0 +1,57 @@
+import mongomock
+from bson.objectid import ObjectId
+from flask import Flask
+
+from pagination import keyset_query
+
+app = Flask(__name__)
+
+
+def make_collection(count):
+    collection = mongomock.MongoClient().db.articles
+    ids = [ObjectId() for _ in range(count)]
+    collection.insert_many([{"_id": _id} for _id in ids])
+    return collection, ids[::-1]
+
+
+def page(collection, query_string=""):
+    with app.test_request_context("/?" + query_string):
+        items, pagination = keyset_query(collection, per_page=3)
+    return [item["_id"] for item in items], pagination
+
+
+def test_pages_forward_newest_first():
+    collection, newest = make_collection(7)
+
+    first, pagination = page(collection)
+    second, next_pagination = page(
+        collection, "after={}".format(pagination.last_id))
+    last, last_pagination = page(
+        collection, "after={}".format(next_pagination.last_id))
+
+    assert first == newest[:3]
+    assert (pagination.has_prev, pagination.has_next) == (False, True)
+    assert second == newest[3:6]
+    assert (next_pagination.has_prev, next_pagination.has_next) == (True,
+                                                                    True)
+    assert last == newest[6:]
+    assert (last_pagination.has_prev, last_pagination.has_next) == (True,
+                                                                    False)
+
+
+def test_pages_back_to_the_start():
+    collection, newest = make_collection(7)
+
+    back, pagination = page(collection, "before={}".format(newest[3]))
+
+    assert back == newest[:3]
+    assert (pagination.has_prev, pagination.has_next) == (False, True)
+
+
+def test_ignores_malformed_cursor():
+    collection, newest = make_collection(4)
+
+    items, pagination = page(collection, "after=not-an-id")
+
+    assert items == newest[:3]
+    assert not pagination.has_prev
@@ -0,0 +1,20 @@
+import pytest
+
+from popularity import ViewCounter
+
+
+class FailingCollection:
+    def bulk_write(self, requests, ordered=True):
+        raise ConnectionError("primary stepped down")
+
+
+def test_failed_flush_keeps_counts():
+    counter = ViewCounter(FailingCollection)
+    counter.record("a")
+    counter.record("a")
+
+    with pytest.raises(ConnectionError):
+        counter.flush()
+    counter.record("a")
+
+    assert counter._pending == {"a": 3}
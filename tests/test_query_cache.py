@@ -0,0 +1,22 @@
+from query_cache import QueryCache, normalize_query
+
+
+def test_normalize_query_folds_case_space_and_stop_words():
+    assert normalize_query("  The Cliffs\tof  MOHER ") == "cliffs moher"
+
+
+def test_normalize_query_keeps_stop_word_only_queries():
+    assert normalize_query("It is") == "it is"
+    assert normalize_query(None) == ""
+
+
+def test_bump_discards_results_loaded_meanwhile():
+    cache = QueryCache()
+
+    def loader():
+        cache.bump()
+        return [1]
+
+    cache.get("moher", loader)
+
+    assert cache.get("moher", lambda: [2]) == [2]
@@ -0,0 +1,23 @@
+from ratelimit import MemoryStorage
+
+
+def test_bucket_allows_burst_then_waits_for_refill():
+    storage = MemoryStorage()
+
+    results = [storage.take("ip:1", 2, 3, 100.0) for _ in range(4)]
+
+    assert [allowed for allowed, wait in results] == [True] * 3 + [False]
+    assert results[-1][1] == 0.5
+    assert storage.take("ip:1", 2, 3, 100.5)[0]
+
+
+def test_buckets_are_per_key_and_bounded():
+    storage = MemoryStorage(max_keys=2)
+
+    storage.take("ip:1", 1, 1, 0.0)
+    storage.take("ip:2", 1, 1, 0.0)
+    storage.take("ip:3", 1, 1, 0.0)
+
+    assert not storage.take("ip:3", 1, 1, 0.0)[0]
+    # The oldest bucket was evicted, so it starts full again
+    assert storage.take("ip:1", 1, 1, 0.0)[0]
@@ -0,0 +1,37 @@
+from search import InvertedIndex
+
+
+def make_index():
+    index = InvertedIndex()
+    index.rebuild([
+        {"_id": 1, "article_name": "Walking the Burren",
+         "article_article": "Limestone and wild flowers",
+         "topic_name": "Hiking"},
+        {"_id": 2, "article_name": "Cliffs of Moher",
+         "article_article": "A walk along the cliffs to the Burren",
+         "topic_name": "Sightseeing"},
+        {"_id": 3, "article_name": "Dublin pubs",
+         "article_article": "Music most nights", "topic_name": "Food"},
+    ])
+    return index
+
+
+def test_title_match_ranks_first():
+    assert make_index().search("burren") == [1, 2]
+
+
+def test_matches_word_prefixes():
+    assert set(make_index().search("walk")) == {1, 2}
+    assert make_index().search("dub") == [3]
+
+
+def test_add_replaces_and_remove_drops():
+    index = make_index()
+
+    index.add({"_id": 3, "article_name": "Galway pubs"})
+    index.remove(1)
+
+    assert index.search("dublin") == []
+    assert index.search("galway") == [3]
+    assert index.search("burren") == [2]
+    assert len(index) == 2
@@ -0,0 +1,52 @@
+from flask import Flask, flash, redirect
+from flask_wtf.csrf import CSRFProtect
+from jinja2 import DictLoader
+
+from streaming import stream_page
+
+LAYOUT = ("{% for message in get_flashed_messages() %}"
+          "<p>{{ message }}</p>{% endfor %}"
+          '<form method="post" action="/search">'
+          '<input name="csrf_token" value="{{ csrf_token() }}"></form>')
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.jinja_loader = DictLoader({"page.html": LAYOUT})
+    CSRFProtect(app)
+
+    @app.route("/")
+    def index():
+        return stream_page("page.html")
+
+    @app.route("/search", methods=["POST"])
+    def search():
+        return redirect("/")
+
+    @app.route("/saved")
+    def saved():
+        flash("Article saved")
+        return redirect("/")
+
+    return app
+
+
+def test_streamed_page_saves_csrf_token():
+    client = make_app().test_client()
+
+    page = client.get("/").get_data(as_text=True)
+    token = page.split('value="')[1].split('"')[0]
+    response = client.post("/search", data={"csrf_token": token})
+
+    assert response.status_code == 302
+
+
+def test_streamed_page_consumes_flashes():
+    client = make_app().test_client()
+
+    first = client.get("/saved", follow_redirects=True)
+    second = client.get("/")
+
+    assert "Article saved" in first.get_data(as_text=True)
+    assert "Article saved" not in second.get_data(as_text=True)
@@ -0,0 +1,63 @@
+import random
+
+from suggest import MAX_LIMIT, SuggestionIndex, normalize, word_suffixes
+
+
+def brute_force(items, query, limit):
+    ranked = []
+    for (kind, item_id), (label, score) in items.items():
+        positions = [position for position, key
+                     in enumerate(word_suffixes(label))
+                     if key.startswith(query)]
+        if positions:
+            ranked.append((min(positions) > 0, kind != "topic", -score,
+                           normalize(label), (kind, item_id)))
+    ranked.sort()
+    return [(ref[0], ref[1], items[ref][0]) for *_, ref in ranked[:limit]]
+
+
+def random_label(rng):
+    words = ["".join(rng.choice("ab") for _ in range(rng.randint(1, 4)))
+             for _ in range(rng.randint(1, 3))]
+    return " ".join(words)
+
+
+def test_matches_brute_force_through_random_writes():
+    rng = random.Random(7)
+    items = {}
+    for number in range(60):
+        kind = rng.choice(("article", "topic"))
+        items[(kind, str(number))] = (random_label(rng), rng.randint(0, 5))
+    index = SuggestionIndex(lambda: [
+        (kind, item_id, label, score)
+        for (kind, item_id), (label, score) in list(items.items())])
+    queries = ["a", "b", "aa", "ab", "ba", "bb", "aab", "bab", "abba",
+               "a b"]
+
+    for step in range(400):
+        if step % 3 == 0 and items:
+            ref = rng.choice(sorted(items))
+            del items[ref]
+            index.remove(*ref)
+        else:
+            ref = (rng.choice(("article", "topic")),
+                   str(rng.randint(0, 80)))
+            items[ref] = (random_label(rng), rng.randint(0, 5))
+            index.put(ref[0], ref[1], *items[ref])
+        query = rng.choice(queries)
+        assert index.suggest(query, MAX_LIMIT) == brute_force(
+            items, query, MAX_LIMIT)
+
+    for query in queries:
+        assert index.suggest(query, 3) == brute_force(items, query, 3)
+
+
+def test_names_starting_with_the_query_come_first():
+    index = SuggestionIndex(lambda: [
+        ("article", "1", "Old Dublin", 10),
+        ("article", "2", "Dublin Bay", 1),
+        ("topic", "3", "Dublin", 0),
+    ])
+
+    assert [label for _, _, label in index.suggest("dub")] == [
+        "Dublin", "Dublin Bay", "Old Dublin"]
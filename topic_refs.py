@@ -0,0 +1,139 @@
+"""
+Topic references by ObjectId.
+
+Articles and further_reading store the `topic_id` of their topic next to
+its `topic_name`, so topic filters can go straight to an indexed
+{topic_id, _id} query. Renaming a topic writes only the topic document:
+pages show the current name by looking the id up in the cached topics
+list. The names stored on articles and further reading, which the text
+index and the in-memory search index use, are brought up to date later
+by sync_topic_names() from the sync-topic-names command.
+
+migrate_topic_ids() backfills topic_id on documents written before
+this, or saved while their topic could not be found, in _id order and
+in batches. It only touches documents without a topic_id, so an
+interrupted run just resumes when started again. Until it has run,
+topic_match() still finds those documents by name.
+"""
+from pymongo import UpdateOne
+
+COLLECTIONS = ("articles", "further_reading")
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def topic_filter(topic):
+    """
+    Returns the filter selecting a topic document by id or, for
+    documents not yet migrated, by name.
+    """
+    if isinstance(topic, str):
+        return {"topic_name": topic}
+    return {"_id": topic}
+
+
+def topic_match(topic):
+    """
+    Returns the filter for the documents of a topic document: those
+    referencing its id, and unmigrated ones still naming it.
+    """
+    return {"$or": [{"topic_id": topic["_id"]},
+                    {"topic_id": None, "topic_name": topic["topic_name"]}]}
+
+
+def rename_topic(db, topic, name):
+    """
+    Renames a topic. Documents still found only by the old name are
+    given its topic_id first so they keep their topic; once
+    migrate_topic_ids() has run there are none and the rename is a
+    single document write.
+    """
+    for collection in COLLECTIONS:
+        db[collection].update_many(
+            {"topic_id": None, "topic_name": topic["topic_name"]},
+            {"$set": {"topic_id": topic["_id"]}})
+    db.topics.update_one({"_id": topic["_id"]},
+                         {"$set": {"topic_name": name}})
+
+
+def sync_topic_names(db, report=print):
+    """
+    Rewrites the topic_name stored on articles and further reading that
+    still carry a renamed topic's old name, one topic at a time, and
+    returns {collection: updated}.
+    """
+    topics = list(db.topics.find({}, {"topic_name": 1}))
+    results = {}
+    for collection in COLLECTIONS:
+        updated = 0
+        for topic in topics:
+            updated += db[collection].update_many(
+                {"topic_id": topic["_id"],
+                 "topic_name": {"$ne": topic["topic_name"]}},
+                {"$set": {"topic_name": topic["topic_name"]}}
+            ).modified_count
+        report("{}: {} updated".format(collection, updated))
+        results[collection] = updated
+    return results
+
+
+def topic_key(document):
+    """
+    Returns the value identifying a document's topic: its topic_id, or
+    its topic_name before migration.
+    """
+    return document.get("topic_id") or document.get("topic_name")
+
+
+def current_topic_names(documents, topics):
+    """
+    Yields documents with topic_name replaced by the current name of
+    the topic their topic_id points at.
+    """
+    names = {topic["_id"]: topic["topic_name"] for topic in topics}
+    for document in documents:
+        name = names.get(document.get("topic_id"))
+        if name is not None:
+            document["topic_name"] = name
+        yield document
+
+
+def migrate_topic_ids(db, batch_size=DEFAULT_BATCH_SIZE, report=print):
+    """
+    Sets topic_id on every article and further_reading document that
+    does not have one yet, or has None. Returns
+    {collection: (updated, orphaned)} where orphaned documents name a
+    topic that no longer exists.
+    """
+    ids = {topic["topic_name"]: topic["_id"]
+           for topic in db.topics.find({}, {"topic_name": 1})}
+    results = {}
+    for collection in COLLECTIONS:
+        updated = orphaned = 0
+        last_id = None
+        while True:
+            query = {"topic_id": None}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = list(db[collection].find(query, {"topic_name": 1})
+                         .sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            requests = []
+            for document in batch:
+                topic_id = ids.get(document.get("topic_name"))
+                if topic_id is None:
+                    orphaned += 1
+                    continue
+                requests.append(UpdateOne(
+                    {"_id": document["_id"]},
+                    {"$set": {"topic_id": topic_id}}))
+            if requests:
+                db[collection].bulk_write(requests, ordered=False)
+                updated += len(requests)
+            report("{}: {} updated, {} orphaned".format(
+                collection, updated, orphaned))
+        results[collection] = (updated, orphaned)
+    return results
@@ -0,0 +1,89 @@
+"""
+Per-topic article counts and recent article ids, stored on the topic
+documents as `article_count` and `article_list`.
+
+The article write routes keep these up to date with single-document
+atomic updates, and rebuild_topic_stats() recomputes all of them from
+the articles collection with one aggregation. Topics are identified by
+topic_id, or by topic_name for articles not yet migrated.
+"""
+from pymongo import UpdateOne
+
+from topic_refs import topic_filter
+
+# Number of most recent article ids kept in a topic's article_list
+RECENT_ARTICLES = 10
+
+
+def record_article_added(db, topic, article_id):
+    """
+    Counts a new article against its topic and puts its id at the
+    front of the topic's recent article list.
+    """
+    if not topic:
+        return
+    db.topics.update_one(
+        topic_filter(topic),
+        {"$inc": {"article_count": 1},
+         "$push": {"article_list": {"$each": [article_id],
+                                    "$position": 0,
+                                    "$slice": RECENT_ARTICLES}}})
+
+
+def record_article_removed(db, topic, article_id):
+    """
+    Removes a deleted article from its topic's count and recent list.
+    """
+    if not topic:
+        return
+    db.topics.update_one(
+        topic_filter(topic),
+        {"$inc": {"article_count": -1},
+         "$pull": {"article_list": article_id}})
+
+
+def record_article_moved(db, old_topic, new_topic, article_id):
+    """
+    Moves an edited article's contribution from its old topic to its
+    new one. Nothing is written when the topic did not change.
+    """
+    if old_topic == new_topic:
+        return
+    record_article_removed(db, old_topic, article_id)
+    record_article_added(db, new_topic, article_id)
+
+
+def rebuild_topic_stats(db):
+    """
+    Recomputes article_count and article_list for every topic from the
+    articles collection and returns the number of topics updated.
+    """
+    pipeline = [
+        {"$sort": {"_id": -1}},
+        {"$group": {"_id": {"$ifNull": ["$topic_id", "$topic_name"]},
+                    "article_count": {"$sum": 1},
+                    "article_list": {"$push": "$_id"}}},
+        {"$project": {"article_count": 1,
+                      "article_list": {"$slice": ["$article_list",
+                                                  RECENT_ARTICLES]}}},
+    ]
+    stats = {group["_id"]: group for group in
+             db.articles.aggregate(pipeline, allowDiskUse=True)}
+
+    requests = []
+    for topic in db.topics.find({}, {"topic_name": 1}):
+        # Articles not yet migrated are still grouped under the name
+        groups = [stats.get(topic["_id"], {}),
+                  stats.get(topic["topic_name"], {})]
+        recent = sorted((article_id for group in groups
+                         for article_id in group.get("article_list", [])),
+                        reverse=True)
+        requests.append(UpdateOne(
+            {"_id": topic["_id"]},
+            {"$set": {"article_count": sum(group.get("article_count", 0)
+                                           for group in groups),
+                      "article_list": recent[:RECENT_ARTICLES]}}))
+
+    if requests:
+        db.topics.bulk_write(requests, ordered=False)
+    return len(requests)
@@ -0,0 +1,39 @@
+"""
+Per-user contribution counters, stored on the user documents as
+`article_count`.
+
+add_article and delete_article adjust the count with a single $inc, and
+rebuild_user_stats() recomputes every user's count with one aggregation.
+"""
+from pymongo import UpdateOne
+
+# Fields of a user document that pages may show; never the password
+PUBLIC_PROJECTION = {"username": 1, "email": 1, "article_count": 1}
+
+
+def record_user_article(db, username, change):
+    """
+    Adds change (1 or -1) to a user's article count.
+    """
+    if not username:
+        return
+    db.users.update_one({"username": username},
+                        {"$inc": {"article_count": change}})
+
+
+def rebuild_user_stats(db):
+    """
+    Recomputes article_count for every user from the articles
+    collection and returns the number of users updated.
+    """
+    counts = {group["_id"]: group["count"] for group in db.articles.aggregate(
+        [{"$group": {"_id": "$created_by", "count": {"$sum": 1}}}],
+        allowDiskUse=True)}
+
+    requests = [UpdateOne({"_id": user["_id"]},
+                          {"$set": {"article_count":
+                                    counts.get(user["username"], 0)}})
+                for user in db.users.find({}, {"username": 1})]
+    if requests:
+        db.users.bulk_write(requests, ordered=False)
+    return len(requests)